@@ -7,7 +7,7 @@ https://home-assistant.io/components/binary_sensor.psychrometrics/
 import asyncio
 
 from ..psychrometrics import (
-    DOMAIN, PsychrometricsBinarySensor, CONF_NAME,
+    DOMAIN, CONF_CHART, PsychrometricsBinarySensor, CONF_NAME,
     ATTR_FRIENDLY_NAME, ATTR_DEVICE_CLASS)
 
 
@@ -24,7 +24,7 @@ def async_setup_platform(hass, config, async_add_devices, discovery_info=None):
     fn_name = discovery_info[ATTR_FRIENDLY_NAME]
     device_class = discovery_info[ATTR_DEVICE_CLASS]
 
-    chart_handler = hass.data[DOMAIN]
+    chart_handler = hass.data[DOMAIN][discovery_info[CONF_CHART]]
 
     async_add_devices([PsychrometricsBinarySensor(
         chart_handler, name, fn_name, device_class)])
@@ -8,7 +8,7 @@ https://home-assistant.io/components/camera.psychrometrics/
 """
 import asyncio
 
-from ..psychrometrics import DOMAIN, PsychroCam
+from ..psychrometrics import DOMAIN, CONF_CHART, PsychroCam
 
 
 DEPENDENCIES = ['psychrometrics']
@@ -21,7 +21,7 @@ def async_setup_platform(hass, config, async_add_devices, discovery_info):
     if discovery_info is None:
         return
 
-    chart_handler = hass.data[DOMAIN]
+    chart_handler = hass.data[DOMAIN][discovery_info[CONF_CHART]]
 
     async_add_devices(
         [PsychroCam(hass, chart_handler, discovery_info['name'])])
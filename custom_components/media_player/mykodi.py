@@ -5,12 +5,19 @@ For more details about this platform, please refer to the documentation at
 https://home-assistant.io/components/media_player.kodi/
 """
 import asyncio
+from bisect import insort
 from collections import OrderedDict
+from datetime import timedelta
 from functools import wraps
+import hashlib
+import heapq
+import io
+from itertools import islice
 import logging
 import urllib
-import re
 import os
+from time import monotonic
+import unicodedata
 
 import aiohttp
 import voluptuous as vol
@@ -30,8 +37,10 @@ from homeassistant.const import (
 from homeassistant.core import callback
 from homeassistant.helpers.aiohttp_client import async_get_clientsession
 from homeassistant.helpers import script, config_validation as cv
+from homeassistant.helpers.event import async_track_point_in_utc_time
 from homeassistant.helpers.template import Template
 from homeassistant.util.yaml import dump
+import homeassistant.util.dt as dt_util
 
 REQUIREMENTS = ['jsonrpc-async==0.6', 'jsonrpc-websocket==0.5']
 
@@ -52,6 +61,39 @@ DEFAULT_TIMEOUT = 5
 DEFAULT_PROXY_SSL = False
 DEFAULT_ENABLE_WEBSOCKET = True
 
+# Properties of the state polling
+APP_PROPERTIES = ['volume', 'muted']
+PLAYER_PROPERTIES = ['time', 'totaltime', 'speed', 'live']
+ITEM_PROPERTIES = ['title', 'file', 'uniqueid', 'thumbnail', 'artist',
+                   'albumartist', 'showtitle', 'album', 'season', 'episode']
+
+# Max age of the music library index when there is no websocket connection
+# (with it, the index is refreshed with the library notifications).
+LIBRARY_MAX_AGE = 3600
+# Index kind, `AudioLibrary` details method and id key of the item types of
+# the library notifications.
+LIBRARY_ITEM_TYPES = {
+    'artist': ('artists', 'GetArtistDetails', 'artistid'),
+    'album': ('albums', 'GetAlbumDetails', 'albumid'),
+    'song': ('songs', 'GetSongDetails', 'songid')}
+
+# Artwork cache (shared by all the Kodi players), with the thumbnails
+# resized (with Pillow, if installed) to fit in ARTWORK_SIZE px and an LRU
+# eviction over ARTWORK_CACHE_BYTES.
+ARTWORK_SIZE = 500
+ARTWORK_CACHE_BYTES = 8 * 1024 ** 2
+
+# Backoff (s) of the websocket reconnections and of the polling when Kodi is
+# unreachable, doubling the delay after each failure.
+RETRY_MIN_DELAY = 10
+RETRY_MAX_DELAY = 300
+
+# All the Kodi players are polled by one coordinator, one at a time, in turns
+# spread over the scan interval.
+SCAN_INTERVAL = timedelta(seconds=10)
+# Smoothing factor of the mean RPC latency of each player
+LATENCY_EWMA_ALPHA = .2
+
 DEPRECATED_TURN_OFF_ACTIONS = {
     None: None,
     'quit': 'Application.Quit',
@@ -99,14 +141,22 @@ PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
 })
 
 SERVICE_ADD_MEDIA = 'kodi_add_to_playlist'
+SERVICE_BULK_ADD_MEDIA = 'kodi_bulk_add_to_playlist'
 SERVICE_CALL_METHOD = 'kodi_call_method'
 
 DATA_KODI = 'kodi'
+DATA_KODI_ARTWORK = 'kodi_artwork'
+DATA_KODI_COORDINATOR = 'kodi_coordinator'
+
+ATTR_RPC_LATENCY = 'rpc_latency'
+ATTR_WEBSOCKET = 'websocket'
 
 ATTR_MEDIA_TYPE = 'media_type'
 ATTR_MEDIA_NAME = 'media_name'
 ATTR_MEDIA_ARTIST_NAME = 'artist_name'
 ATTR_MEDIA_ID = 'media_id'
+ATTR_MEDIA_IDS = 'media_ids'
+ATTR_MEDIA_NAMES = 'media_names'
 ATTR_METHOD = 'method'
 
 MEDIA_PLAYER_ADD_MEDIA_SCHEMA = MEDIA_PLAYER_SCHEMA.extend({
@@ -115,6 +165,12 @@ MEDIA_PLAYER_ADD_MEDIA_SCHEMA = MEDIA_PLAYER_SCHEMA.extend({
     vol.Optional(ATTR_MEDIA_NAME): cv.string,
     vol.Optional(ATTR_MEDIA_ARTIST_NAME): cv.string,
 })
+MEDIA_PLAYER_BULK_ADD_MEDIA_SCHEMA = MEDIA_PLAYER_SCHEMA.extend({
+    vol.Required(ATTR_MEDIA_TYPE): cv.string,
+    vol.Optional(ATTR_MEDIA_IDS): vol.All(cv.ensure_list, [cv.positive_int]),
+    vol.Optional(ATTR_MEDIA_NAMES): vol.All(cv.ensure_list, [cv.string]),
+    vol.Optional(ATTR_MEDIA_ARTIST_NAME): cv.string,
+})
 MEDIA_PLAYER_CALL_METHOD_SCHEMA = MEDIA_PLAYER_SCHEMA.extend({
     vol.Required(ATTR_METHOD): cv.string,
 }, extra=vol.ALLOW_EXTRA)
@@ -123,6 +179,9 @@ SERVICE_TO_METHOD = {
     SERVICE_ADD_MEDIA: {
         'method': 'async_add_media_to_playlist',
         'schema': MEDIA_PLAYER_ADD_MEDIA_SCHEMA},
+    SERVICE_BULK_ADD_MEDIA: {
+        'method': 'async_bulk_add_to_playlist',
+        'schema': MEDIA_PLAYER_BULK_ADD_MEDIA_SCHEMA},
     SERVICE_CALL_METHOD: {
         'method': 'async_call_method',
         'schema': MEDIA_PLAYER_CALL_METHOD_SCHEMA},
@@ -158,6 +217,9 @@ def async_setup_platform(hass, config, async_add_devices, discovery_info=None):
     """Set up the Kodi platform."""
     if DATA_KODI not in hass.data:
         hass.data[DATA_KODI] = []
+        hass.data[DATA_KODI_ARTWORK] = KodiArtworkCache(ARTWORK_CACHE_BYTES)
+        hass.data[DATA_KODI_COORDINATOR] = KodiCoordinator(
+            hass, SCAN_INTERVAL)
     name = config.get(CONF_NAME)
     host = config.get(CONF_HOST)
     port = config.get(CONF_PORT)
@@ -166,7 +228,7 @@ def async_setup_platform(hass, config, async_add_devices, discovery_info=None):
     websocket = config.get(CONF_ENABLE_WEBSOCKET)
 
     entity = KodiDevice(
-        hass,
+        hass, hass.data[DATA_KODI_COORDINATOR],
         name=name,
         host=host, port=port, tcp_port=tcp_port, encryption=encryption,
         username=config.get(CONF_USERNAME),
@@ -200,7 +262,7 @@ def async_setup_platform(hass, config, async_add_devices, discovery_info=None):
             yield from getattr(player, method['method'])(**params)
 
         for player in target_players:
-            if player.should_poll:
+            if not player.ws_connected:
                 update_coro = player.async_update_ha_state(True)
                 update_tasks.append(update_coro)
 
@@ -221,6 +283,313 @@ def async_setup_platform(hass, config, async_add_devices, discovery_info=None):
             description=descriptions.get(service), schema=schema)
 
 
+class RetryBackoff(object):
+    """Retry delay, doubling after each failure (up to a max delay)."""
+
+    def __init__(self, min_delay=RETRY_MIN_DELAY, max_delay=RETRY_MAX_DELAY):
+        """Initialize the backoff, ready to try."""
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.delay = 0
+        self.retry_at = 0
+
+    def ready(self):
+        """Return True if the retry delay has passed."""
+        return monotonic() >= self.retry_at
+
+    def failure(self):
+        """Increase the retry delay after a failure."""
+        self.delay = min(max(2 * self.delay, self.min_delay), self.max_delay)
+        self.retry_at = monotonic() + self.delay
+
+    def reset(self):
+        """Reset the retry delay (after a success)."""
+        self.delay = 0
+        self.retry_at = 0
+
+
+class KodiCoordinator(object):
+    """Owner of the connections and of the polling of all the Kodi players.
+
+    Instead of being polled by HA at the same time, the players are polled
+    one at a time, in turns spread over the scan interval, and only while
+    they have no websocket connection. The websockets are reconnected in
+    the same turns, with a retry backoff for each player.
+    """
+
+    def __init__(self, hass, scan_interval):
+        """Initialize the coordinator, without players."""
+        self.hass = hass
+        self.scan_interval = scan_interval
+        # (player, websocket server, websocket backoff) of each turn
+        self._turns = []
+        self._refreshing = set()
+        self._turn = 0
+        self._unsub_tick = None
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, self._async_stop)
+
+    def connect(self, device, http_url, ws_url, **kwargs):
+        """Make the JSON-RPC servers of a player and add it to the turns.
+
+        :return: the HTTP server and the websocket server (or None).
+        """
+        import jsonrpc_async
+        import jsonrpc_websocket
+
+        http_server = jsonrpc_async.Server(http_url, **kwargs)
+        ws_server = None
+        if ws_url is not None:
+            ws_server = jsonrpc_websocket.Server(ws_url, **kwargs)
+        self._turns.append((device, ws_server, RetryBackoff()))
+        if self._unsub_tick is None:
+            self._async_schedule_tick()
+        return http_server, ws_server
+
+    @callback
+    def _async_schedule_tick(self):
+        """Schedule the next turn, spreading them over the scan interval."""
+        period = self.scan_interval / len(self._turns)
+        self._unsub_tick = async_track_point_in_utc_time(
+            self.hass, self._async_tick, dt_util.utcnow() + period)
+
+    @callback
+    def _async_tick(self, now):
+        """Refresh the player of this turn and schedule the next one."""
+        index = self._turn % len(self._turns)
+        self._turn += 1
+        if self._turns[index][0].entity_id is not None \
+                and index not in self._refreshing:
+            self.hass.async_add_job(self._async_refresh(index))
+        self._async_schedule_tick()
+
+    @asyncio.coroutine
+    def _async_refresh(self, index):
+        """Poll a player without websocket connection and reconnect it."""
+        device, ws_server, backoff = self._turns[index]
+        self._refreshing.add(index)
+        try:
+            if not device.ws_connected:
+                yield from device.async_update_ha_state(True)
+
+            if ws_server is None or ws_server.connected \
+                    or device.state == STATE_OFF or not backoff.ready():
+                return
+            if (yield from device.async_ws_connect()):
+                backoff.reset()
+            else:
+                backoff.failure()
+                _LOGGER.info("Unable to connect to %s via websocket, "
+                             "retrying in %d s", device.name, backoff.delay)
+        finally:
+            self._refreshing.discard(index)
+
+    @callback
+    def _async_stop(self, event):
+        """Stop the polling and close the websockets when hass stops."""
+        if self._unsub_tick is not None:
+            self._unsub_tick()
+            self._unsub_tick = None
+        for _, ws_server, _ in self._turns:
+            if ws_server is not None:
+                self.hass.async_add_job(ws_server.close())
+
+
+def _time_to_seconds(kodi_time):
+    """Return the seconds of a Kodi time dict (hours, minutes, ...)."""
+    return (kodi_time['hours'] * 3600 + kodi_time['minutes'] * 60 +
+            kodi_time['seconds'] + kodi_time.get('milliseconds', 0) / 1000)
+
+
+def resize_artwork(content, size=ARTWORK_SIZE):
+    """Return a JPEG of an image reduced to fit in `size` px.
+
+    None is returned when the image doesn't need it, or can't be resized.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+
+    try:
+        image = Image.open(io.BytesIO(content))
+        if max(image.size) <= size and image.format == 'JPEG':
+            return None
+        image.thumbnail((size, size))
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        resized = io.BytesIO()
+        image.save(resized, 'JPEG', quality=85, optimize=True)
+    except (OSError, ValueError) as exc:
+        _LOGGER.debug("Unable to resize Kodi artwork: %s", exc)
+        return None
+    return resized.getvalue()
+
+
+class KodiArtworkCache(object):
+    """LRU cache of the artwork images, bounded by their total size."""
+
+    def __init__(self, max_bytes):
+        """Initialize an empty cache."""
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._images = OrderedDict()
+
+    def get(self, key):
+        """Return the (content, content_type) of an image, or None."""
+        image = self._images.get(key)
+        if image is not None:
+            self._images.move_to_end(key)
+        return image
+
+    def put(self, key, content, content_type):
+        """Store an image, evicting the least recently used ones."""
+        if len(content) > self.max_bytes:
+            return
+        old_image = self._images.pop(key, None)
+        if old_image is not None:
+            self.size -= len(old_image[0])
+        self._images[key] = (content, content_type)
+        self.size += len(content)
+        while self.size > self.max_bytes:
+            _, (old_content, _) = self._images.popitem(last=False)
+            self.size -= len(old_content)
+
+
+def fold_tokens(name):
+    """Return the accent-folded, lower-cased words of a name."""
+    name = unicodedata.normalize('NFKD', name)
+    return ''.join(c for c in name
+                   if not unicodedata.combining(c)).lower().split(' ')
+
+
+class KodiMusicLibrary(object):
+    """Local index of the Kodi music library for the name lookups.
+
+    Artists, albums and songs are indexed by the (accent-folded and
+    lower-cased) words of their names and by artist id. A lookup scores
+    only the entries sharing some word with the query, counting the query
+    words in the precomputed word set of each entry, and selects the best
+    ones with a partial sort.
+    """
+
+    def __init__(self):
+        """Initialize an empty (stale) index."""
+        self.entries = {'artists': [], 'albums': [], 'songs': []}
+        self._entry_tokens = {kind: [] for kind in self.entries}
+        self._tokens = {kind: {} for kind in self.entries}
+        self._by_artist = {kind: {} for kind in self.entries}
+        self._positions = {kind: {} for kind in self.entries}
+        self.stale = True
+        self.updated = None
+
+    def load(self, artists, albums, songs):
+        """Build the index with the `AudioLibrary.Get*` results."""
+        self.entries = {
+            'artists': [(a['artistid'], a['artist'], [a['artistid']])
+                        for a in artists.get('artists', [])],
+            'albums': [(a['albumid'], a['label'], a.get('artistid', []))
+                       for a in albums.get('albums', [])],
+            'songs': [(a['songid'], a['label'], a.get('artistid', []))
+                      for a in songs.get('songs', [])]}
+        for kind, entries in self.entries.items():
+            self._entry_tokens[kind] = [frozenset()] * len(entries)
+            self._tokens[kind] = {}
+            self._by_artist[kind] = {}
+            self._positions[kind] = {}
+            for idx, entry in enumerate(entries):
+                self._positions[kind][entry[0]] = idx
+                self._index(kind, idx, entry)
+        self.stale = False
+        self.updated = monotonic()
+        _LOGGER.debug('Kodi music library indexed: %s', {
+            kind: len(entries) for kind, entries in self.entries.items()})
+
+    def update(self, kind, item_id, label, artist_ids):
+        """Add or update one entry (after an `AudioLibrary.OnUpdate`)."""
+        idx = self._positions[kind].get(item_id)
+        if idx is None:
+            idx = len(self.entries[kind])
+            self.entries[kind].append(None)
+            self._entry_tokens[kind].append(frozenset())
+            self._positions[kind][item_id] = idx
+        else:
+            self._unindex(kind, idx)
+        self._index(kind, idx, (item_id, label, artist_ids))
+
+    def remove(self, kind, item_id):
+        """Drop one entry (after an `AudioLibrary.OnRemove`).
+
+        The entry is left without label, to keep the other positions.
+        """
+        idx = self._positions[kind].pop(item_id, None)
+        if idx is not None:
+            self._unindex(kind, idx)
+            self.entries[kind][idx] = (item_id, None, [])
+
+    def _index(self, kind, idx, entry):
+        """Index the words and artists of the entry in some position."""
+        _, label, artist_ids = entry
+        self.entries[kind][idx] = entry
+        label_tokens = frozenset(fold_tokens(label))
+        self._entry_tokens[kind][idx] = label_tokens
+        for token in label_tokens:
+            self._tokens[kind].setdefault(token, set()).add(idx)
+        for artist_id in artist_ids:
+            insort(self._by_artist[kind].setdefault(artist_id, []), idx)
+
+    def _unindex(self, kind, idx):
+        """Remove the words and artists of the entry in some position."""
+        tokens, by_artist = self._tokens[kind], self._by_artist[kind]
+        for token in self._entry_tokens[kind][idx]:
+            tokens[token].discard(idx)
+            if not tokens[token]:
+                del tokens[token]
+        for artist_id in self.entries[kind][idx][2]:
+            by_artist[artist_id].remove(idx)
+            if not by_artist[artist_id]:
+                del by_artist[artist_id]
+        self._entry_tokens[kind][idx] = frozenset()
+
+    def search(self, kind, name, artist_id=None, limit=1):
+        """Return the ids of the best `limit` matches of a name.
+
+        Entries are sorted by the number of query words in their names
+        (and by library order for the same score); the ones without any
+        word of the query go last.
+        """
+        if artist_id is None:
+            positions = range(len(self.entries[kind]))
+        else:
+            positions = self._by_artist[kind].get(artist_id, [])
+        if not positions:
+            return []
+
+        query = fold_tokens(name)
+        tokens = self._tokens[kind]
+        candidates = set()
+        for token in query:
+            candidates.update(tokens.get(token, ()))
+        if artist_id is not None:
+            candidates.intersection_update(positions)
+
+        entry_tokens = self._entry_tokens[kind]
+        best = heapq.nsmallest(
+            limit, ((-sum(token in entry_tokens[idx] for token in query), idx)
+                    for idx in candidates))
+        best = [idx for _, idx in best]
+        if len(best) < limit:  # (entries without matching words)
+            entries = self.entries[kind]
+            best += islice((idx for idx in positions if idx not in candidates
+                            and entries[idx][1] is not None),
+                           limit - len(best))
+        return [self.entries[kind][idx][0] for idx in best]
+
+    def find(self, kind, name, artist_id=None):
+        """Return the id of the best match of a name, or None."""
+        best = self.search(kind, name, artist_id, limit=1)
+        return best[0] if best else None
+
+
 def cmd(func):
     """Catch command exceptions."""
     @wraps(func)
@@ -244,13 +613,11 @@ def cmd(func):
 class KodiDevice(MediaPlayerDevice):
     """Representation of a XBMC/Kodi device."""
 
-    def __init__(self, hass, name, host, port, tcp_port, encryption=False,
-                 username=None, password=None,
+    def __init__(self, hass, coordinator, name, host, port, tcp_port,
+                 encryption=False, username=None, password=None,
                  turn_on_action=None, turn_off_action=None, use_off_mode=False,
                  timeout=DEFAULT_TIMEOUT, websocket=True):
         """Initialize the Kodi device."""
-        import jsonrpc_async
-        import jsonrpc_websocket
         self.hass = hass
         self._name = name
 
@@ -261,42 +628,39 @@ class KodiDevice(MediaPlayerDevice):
 
         if username is not None:
             kwargs['auth'] = aiohttp.BasicAuth(username, password)
-            image_auth_string = "{}:{}@".format(username, password)
-        else:
-            image_auth_string = ""
+        self._http_kwargs = kwargs
 
         http_protocol = 'https' if encryption else 'http'
         ws_protocol = 'wss' if encryption else 'ws'
 
         self._http_url = '{}://{}:{}/jsonrpc'.format(http_protocol, host, port)
-        self._image_url = '{}://{}{}:{}/image'.format(
-            http_protocol, image_auth_string, host, port)
+        self._image_url = '{}://{}:{}/image'.format(http_protocol, host, port)
         self._ws_url = '{}://{}:{}/jsonrpc'.format(ws_protocol, host, tcp_port)
 
-        self._http_server = jsonrpc_async.Server(self._http_url, **kwargs)
+        # Setup the connections (owned by the coordinator)
+        self._http_server, self._ws_server = coordinator.connect(
+            self, self._http_url, self._ws_url if websocket else None,
+            **kwargs)
         if websocket:
-            # Setup websocket connection
-            self._ws_server = jsonrpc_websocket.Server(self._ws_url, **kwargs)
-
             # Register notification listeners
             self._ws_server.Player.OnPause = self.async_on_speed_event
             self._ws_server.Player.OnPlay = self.async_on_speed_event
             self._ws_server.Player.OnSpeedChanged = self.async_on_speed_event
             self._ws_server.Player.OnStop = self.async_on_stop
+            self._ws_server.Player.OnSeek = self.async_on_seek
             self._ws_server.Application.OnVolumeChanged = \
                 self.async_on_volume_changed
             self._ws_server.System.OnQuit = self.async_on_quit
             self._ws_server.System.OnRestart = self.async_on_quit
             self._ws_server.System.OnSleep = self.async_on_quit
-
-            def on_hass_stop(event):
-                """Close websocket connection when hass stops."""
-                self.hass.async_add_job(self._ws_server.close())
-
-            self.hass.bus.async_listen_once(
-                EVENT_HOMEASSISTANT_STOP, on_hass_stop)
-        else:
-            self._ws_server = None
+            self._ws_server.AudioLibrary.OnScanFinished = \
+                self.async_on_library_scanned
+            self._ws_server.AudioLibrary.OnCleanFinished = \
+                self.async_on_library_scanned
+            self._ws_server.AudioLibrary.OnUpdate = \
+                self.async_on_library_updated
+            self._ws_server.AudioLibrary.OnRemove = \
+                self.async_on_library_removed
 
         # Script creation for the turn on/off config options
         if turn_on_action is not None:
@@ -317,13 +681,44 @@ class KodiDevice(MediaPlayerDevice):
         self._properties = {}
         self._item = {}
         self._app_properties = {}
+        self._library = KodiMusicLibrary()
+        self._library_lock = asyncio.Lock(loop=hass.loop)
+        self._last_player_id = None
+        # Playback position, tracked locally between the notifications
+        self._position = None
+        self._position_updated_at = None
+        self._poll_backoff = RetryBackoff()
+        self._rpc_latency = None
+
+    def _set_position(self, seconds=None):
+        """Set the playback position, or move it to the current time."""
+        now = dt_util.utcnow()
+        if seconds is None:
+            if self._position is None:
+                return
+            speed = self._properties.get('speed', 0)
+            seconds = self._position + speed * (
+                now - self._position_updated_at).total_seconds()
+        self._position = seconds
+        self._position_updated_at = now
+
+    def _reset_state(self):
+        """Clear the player state."""
+        self._properties = {}
+        self._item = {}
+        self._position = None
 
     @callback
     def async_on_speed_event(self, sender, data):
-        """Handle player changes between playing and paused."""
+        """Handle player changes between playing and paused.
+
+        The playback position is moved with the previous speed, so the
+        state only needs to be re-queried when a new item is playing.
+        """
+        self._set_position()
         self._properties['speed'] = data['player']['speed']
 
-        if not hasattr(data['item'], 'id'):
+        if 'id' not in data['item']:
             # If no item id is given, perform a full update
             force_refresh = True
         else:
@@ -332,6 +727,16 @@ class KodiDevice(MediaPlayerDevice):
 
         self.async_schedule_update_ha_state(force_refresh)
 
+    @callback
+    def async_on_seek(self, sender, data):
+        """Handle the seeks in the current item."""
+        if 'time' not in data['player'] or self._position is None:
+            self.async_schedule_update_ha_state(True)
+            return
+
+        self._set_position(_time_to_seconds(data['player']['time']))
+        self.async_schedule_update_ha_state()
+
     @callback
     def async_on_stop(self, sender, data):
         """Handle the stop of the player playback."""
@@ -340,8 +745,7 @@ class KodiDevice(MediaPlayerDevice):
             return
 
         self._players = []
-        self._properties = {}
-        self._item = {}
+        self._reset_state()
         self.async_schedule_update_ha_state()
 
     @callback
@@ -351,13 +755,40 @@ class KodiDevice(MediaPlayerDevice):
         self._app_properties['muted'] = data['muted']
         self.async_schedule_update_ha_state()
 
+    @callback
+    def async_on_library_scanned(self, sender, data):
+        """Rebuild the music library index after a scan or clean."""
+        self._library.stale = True
+        # Refresh it now (and not in the next lookup)
+        self.hass.async_add_job(self.async_get_library())
+
+    @callback
+    def async_on_library_updated(self, sender, data):
+        """Update the entry of a changed item in the music library index."""
+        item_type = LIBRARY_ITEM_TYPES.get(data.get('item', {}).get('type'))
+        if item_type is None or self._library.stale:
+            return
+        # Nothing to do with the playcount changes (the names are the same)
+        # or within a scan (the index is rebuilt when it is finished)
+        if data.get('transaction') or (
+                'playcount' in data and not data.get('added')):
+            return
+        self.hass.async_add_job(
+            self.async_update_library_item(item_type, data['item']['id']))
+
+    @callback
+    def async_on_library_removed(self, sender, data):
+        """Drop the entry of a removed item from the music library index."""
+        item_type = LIBRARY_ITEM_TYPES.get(data.get('item', {}).get('type'))
+        if item_type is not None and not self._library.stale:
+            self._library.remove(item_type[0], data['item']['id'])
+
     @callback
     def async_on_quit(self, sender, data):
         """Reset the player state on quit action."""
         self._flag_switch_off = True
         self._players = None
-        self._properties = {}
-        self._item = {}
+        self._reset_state()
         self._app_properties = {}
         self.hass.async_add_job(self._ws_server.close())
 
@@ -393,15 +824,17 @@ class KodiDevice(MediaPlayerDevice):
 
     @asyncio.coroutine
     def async_ws_connect(self):
-        """Connect to Kodi via websocket protocol."""
+        """Connect to Kodi via websocket protocol.
+
+        :return: True if connected.
+        """
         import jsonrpc_base
         try:
             ws_loop_future = yield from self._ws_server.ws_connect()
         except jsonrpc_base.jsonrpc.TransportError:
-            _LOGGER.info("Unable to connect to Kodi via websocket")
             _LOGGER.debug(
                 "Unable to connect to Kodi via websocket", exc_info=True)
-            return
+            return False
 
         @asyncio.coroutine
         def ws_loop_wrapper():
@@ -418,50 +851,129 @@ class KodiDevice(MediaPlayerDevice):
         # Create a task instead of adding a tracking job, since this task will
         # run until the websocket connection is closed.
         self.hass.loop.create_task(ws_loop_wrapper())
+        return True
 
     @asyncio.coroutine
-    def async_update(self):
-        """Retrieve latest state."""
-        self._players = yield from self._get_players()
+    def _async_rpc_batch(self, calls):
+        """Run some JSON-RPC calls with one request and return the results.
 
-        if self._players is None:
-            self._properties = {}
-            self._item = {}
-            self._app_properties = {}
-            return
+        Over HTTP the calls are sent as one JSON-RPC batch; over the
+        websocket, as concurrent requests. Calls with errors (e.g., for a
+        player which is not active) have None as result. The mean latency
+        of the requests is tracked for the state attributes.
+        """
+        import async_timeout
+        import jsonrpc_base
 
-        if self._enable_websocket and not self._ws_server.connected:
-            self.hass.async_add_job(self.async_ws_connect())
+        tic = monotonic()
+        if self.ws_connected:
+            results = yield from asyncio.gather(
+                *[getattr(self._ws_server, method)(*params)
+                  for method, params in calls],
+                loop=self.hass.loop, return_exceptions=True)
+            for result in results:
+                if isinstance(result, jsonrpc_base.jsonrpc.TransportError):
+                    raise result
+            self._track_latency(monotonic() - tic)
+            return [None if isinstance(result, Exception) else result
+                    for result in results]
+
+        payload = [{'jsonrpc': '2.0', 'method': method, 'params': params,
+                    'id': i} for i, (method, params) in enumerate(calls)]
+        try:
+            with async_timeout.timeout(self._http_kwargs['timeout'],
+                                       loop=self.hass.loop):
+                response = yield from self._http_kwargs['session'].post(
+                    self._http_url, json=payload,
+                    auth=self._http_kwargs.get('auth'))
+                if response.status != 200:
+                    raise jsonrpc_base.jsonrpc.TransportError(
+                        'HTTP %d %s' % (response.status, response.reason))
+                responses = yield from response.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as exc:
+            raise jsonrpc_base.jsonrpc.TransportError(
+                'Error in JSON-RPC batch request: {}'.format(exc))
+
+        self._track_latency(monotonic() - tic)
+        results = [None] * len(calls)
+        if isinstance(responses, dict):  # (error for the whole batch)
+            responses = [responses]
+        for resp in responses:
+            if 'result' in resp and resp.get('id') in range(len(calls)):
+                results[resp['id']] = resp['result']
+        return results
+
+    def _track_latency(self, latency):
+        """Update the mean RPC latency with a new request."""
+        if self._rpc_latency is None:
+            self._rpc_latency = latency
+        else:
+            self._rpc_latency += LATENCY_EWMA_ALPHA * (
+                latency - self._rpc_latency)
 
-        self._app_properties = \
-            yield from self.server.Application.GetProperties(
-                ['volume', 'muted']
-            )
+    @asyncio.coroutine
+    def async_update(self):
+        """Retrieve latest state.
 
-        if self._players:
-            player_id = self._players[0]['playerid']
+        All the state is requested with one batch of JSON-RPC calls, with
+        the properties of the last active player; only when the active
+        player changes, a second batch is needed. While Kodi is unreachable,
+        the polls are skipped with a growing delay.
+        """
+        import jsonrpc_base
 
-            assert isinstance(player_id, int)
+        if self._players is None and not self._poll_backoff.ready():
+            return
 
-            self._properties = yield from self.server.Player.GetProperties(
-                player_id,
-                ['time', 'totaltime', 'speed', 'live']
-            )
+        calls = [('Player.GetActivePlayers', []),
+                 ('Application.GetProperties', [APP_PROPERTIES])]
+        player_calls = [
+            ('Player.GetProperties', [self._last_player_id,
+                                      PLAYER_PROPERTIES]),
+            ('Player.GetItem', [self._last_player_id, ITEM_PROPERTIES])]
+        if self._last_player_id is not None:
+            calls += player_calls
+        try:
+            results = yield from self._async_rpc_batch(calls)
+            players = results[0]
+            if players:
+                player_id = players[0]['playerid']
+                assert isinstance(player_id, int)
+                if player_id != self._last_player_id:
+                    self._last_player_id = player_id
+                    for call in player_calls:
+                        call[1][0] = player_id
+                    results[2:] = yield from self._async_rpc_batch(
+                        player_calls)
+        except jsonrpc_base.jsonrpc.TransportError:
+            if self._players is not None:
+                _LOGGER.info("Unable to fetch kodi data")
+                _LOGGER.debug("Unable to fetch kodi data", exc_info=True)
+            players = None
 
-            self._item = (yield from self.server.Player.GetItem(
-                player_id,
-                ['title', 'file', 'uniqueid', 'thumbnail', 'artist',
-                 'albumartist', 'showtitle', 'album', 'season', 'episode']
-            ))['item']
-        else:
-            self._properties = {}
-            self._item = {}
+        self._players = players
+        if self._players is None:
+            self._reset_state()
             self._app_properties = {}
+            self._poll_backoff.failure()
+            return
+        self._poll_backoff.reset()
+
+        self._app_properties = results[1] or {}
+        if self._players and results[2] is not None:
+            self._properties = results[2]
+            self._item = (results[3] or {}).get('item', {})
+            if 'time' in self._properties:
+                self._set_position(_time_to_seconds(self._properties['time']))
+        else:
+            # (no active player, or its properties failed in the batch)
+            self._players = []
+            self._reset_state()
 
     @property
     def server(self):
         """Active server for json-rpc requests."""
-        if self._enable_websocket and self._ws_server.connected:
+        if self.ws_connected:
             return self._ws_server
 
         return self._http_server
@@ -471,10 +983,23 @@ class KodiDevice(MediaPlayerDevice):
         """Return the name of the device."""
         return self._name
 
+    @property
+    def ws_connected(self):
+        """Return True if the state is pushed through the websocket."""
+        return self._enable_websocket and self._ws_server.connected
+
     @property
     def should_poll(self):
-        """Return True if entity has to be polled for state."""
-        return not (self._enable_websocket and self._ws_server.connected)
+        """No polling needed, the coordinator refreshes the state."""
+        return False
+
+    @property
+    def device_state_attributes(self):
+        """Return the connection state attributes."""
+        attributes = {ATTR_WEBSOCKET: self.ws_connected}
+        if self._rpc_latency is not None:
+            attributes[ATTR_RPC_LATENCY] = round(1000 * self._rpc_latency, 1)
+        return attributes
 
     @property
     def volume_level(self):
@@ -513,9 +1038,29 @@ class KodiDevice(MediaPlayerDevice):
             total_time['minutes'] * 60 +
             total_time['seconds'])
 
+    @property
+    def media_position(self):
+        """Position of current playing media in seconds."""
+        if self._properties.get('live') or self._position is None:
+            return None
+
+        return int(self._position)
+
+    @property
+    def media_position_updated_at(self):
+        """When the position of the current playing media was valid."""
+        if self._position is None:
+            return None
+
+        return self._position_updated_at
+
     @property
     def media_image_url(self):
-        """Image url of current playing media."""
+        """Image url of current playing media.
+
+        The image is served through the HA media image proxy, so the url
+        has no credentials.
+        """
         thumbnail = self._item.get('thumbnail')
         if thumbnail is None:
             return None
@@ -526,6 +1071,54 @@ class KodiDevice(MediaPlayerDevice):
                 self._image_url,
                 urllib.parse.quote_plus(thumbnail))
 
+    @property
+    def media_image_hash(self):
+        """Hash value for the media image (of its Kodi thumbnail path)."""
+        thumbnail = self._item.get('thumbnail')
+        if thumbnail is None:
+            return None
+
+        return hashlib.sha256(thumbnail.encode('utf-8')).hexdigest()[:16]
+
+    @asyncio.coroutine
+    def async_get_media_image(self):
+        """Fetch the media image of the current playing media.
+
+        The (resized) images are kept in the artwork cache, so they are
+        downloaded from Kodi and resized only once.
+        """
+        import async_timeout
+
+        url = self.media_image_url
+        if url is None:
+            return None, None
+
+        cache = self.hass.data[DATA_KODI_ARTWORK]
+        image = cache.get(url)
+        if image is not None:
+            return image
+
+        try:
+            with async_timeout.timeout(self._http_kwargs['timeout'],
+                                       loop=self.hass.loop):
+                response = yield from self._http_kwargs['session'].get(
+                    url, auth=self._http_kwargs.get('auth'))
+                if response.status != 200:
+                    _LOGGER.debug("Error %d fetching Kodi artwork %s",
+                                  response.status, url)
+                    return None, None
+                content = yield from response.read()
+                content_type = response.headers.get(aiohttp.hdrs.CONTENT_TYPE)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            _LOGGER.debug("Unable to fetch Kodi artwork %s", url)
+            return None, None
+
+        resized = yield from self.hass.async_add_job(resize_artwork, content)
+        if resized is not None:
+            content, content_type = resized, 'image/jpeg'
+        cache.put(url, content, content_type)
+        return content, content_type
+
     @property
     def media_title(self):
         """Title of current playing media."""
@@ -588,6 +1181,7 @@ class KodiDevice(MediaPlayerDevice):
     @asyncio.coroutine
     def async_turn_on(self):
         """Execute turn_on_action to turn on media player."""
+        self._poll_backoff.reset()  # (poll it again without waiting)
         if self._turn_on_action is not None:
             yield from self._turn_on_action.async_run(
                 variables={"entity_id": self.entity_id})
@@ -799,14 +1393,12 @@ class KodiDevice(MediaPlayerDevice):
         All the albums of an artist can be added with
         media_name="ALL"
         """
-        import jsonrpc_base
-        params = {"playlistid": 0}
         if media_type == "SONG":
             if media_id is None:
                 media_id = yield from self.async_find_song(
                     media_name, artist_name)
             if media_id:
-                params["item"] = {"songid": int(media_id)}
+                item = {"songid": int(media_id)}
 
         elif media_type == "ALBUM":
             if media_id is None:
@@ -817,37 +1409,98 @@ class KodiDevice(MediaPlayerDevice):
                 media_id = yield from self.async_find_album(
                     media_name, artist_name)
             if media_id:
-                params["item"] = {"albumid": int(media_id)}
+                item = {"albumid": int(media_id)}
 
         else:
             raise RuntimeError("Unrecognized media type.")
 
-        if media_id is not None:
-            try:
-                yield from self.server.Playlist.Add(params)
-            except jsonrpc_base.jsonrpc.ProtocolError as exc:
-                result = exc.args[2]['error']
-                _LOGGER.error("Run API method %s.Playlist.Add(%s) error: %s",
-                              self.entity_id, media_type, result)
-            except jsonrpc_base.jsonrpc.TransportError:
-                _LOGGER.warning("TransportError trying to add playlist to %s",
-                                self.entity_id)
+        if media_id:
+            yield from self._async_playlist_add([item])
         else:
             _LOGGER.warning("No media detected for Playlist.Add")
 
+    @asyncio.coroutine
+    def async_bulk_add_to_playlist(self, media_type, media_ids=None,
+                                   media_names=None, artist_name=''):
+        """Add a list of media to default playlist (i.e. playlistid=0).
+
+        The media type must be SONG or ALBUM, and the media can be
+        specified in terms of ids and/or names (and optionally artist name).
+        All the media is added with one request.
+        """
+        if media_type == "SONG":
+            id_key, kind = 'songid', 'songs'
+        elif media_type == "ALBUM":
+            id_key, kind = 'albumid', 'albums'
+        else:
+            raise RuntimeError("Unrecognized media type.")
+
+        media_ids = list(media_ids or [])
+        if media_names:
+            artist_id = None
+            if artist_name != '':
+                artist_id = yield from self.async_find_artist(artist_name)
+            library = yield from self.async_get_library()
+            for media_name in media_names:
+                media_id = library.find(kind, media_name, artist_id)
+                if media_id is None:
+                    _LOGGER.warning("No %s were found with artist: %s, "
+                                    "name: %s", kind, artist_name, media_name)
+                else:
+                    media_ids.append(media_id)
+
+        if media_ids:
+            yield from self._async_playlist_add(
+                [{id_key: int(media_id)} for media_id in media_ids])
+        else:
+            _LOGGER.warning("No media detected for Playlist.Add")
+
+    @asyncio.coroutine
+    def _async_playlist_add(self, items):
+        """Add some items to default playlist (i.e. playlistid=0).
+
+        The item list is sent in one `Playlist.Add` call; if Kodi rejects
+        it, the items are added with one batch of `Playlist.Add` calls.
+        """
+        import jsonrpc_base
+        try:
+            try:
+                yield from self.server.Playlist.Add(playlistid=0, item=items)
+                return
+            except jsonrpc_base.jsonrpc.ProtocolError as exc:
+                if len(items) == 1:
+                    raise
+                _LOGGER.debug("Playlist.Add of an item list error: %s, "
+                              "adding them with a batch", exc)
+            results = yield from self._async_rpc_batch(
+                [('Playlist.Add', [0, item]) for item in items])
+            errors = [item for item, result in zip(items, results)
+                      if result is None]
+            if errors:
+                _LOGGER.error("Run API method %s.Playlist.Add error for %d "
+                              "items: %s", self.entity_id, len(errors), errors)
+        except jsonrpc_base.jsonrpc.ProtocolError as exc:
+            _LOGGER.error("Run API method %s.Playlist.Add(%s) error: %s",
+                          self.entity_id, items, exc.args[2]['error'])
+        except jsonrpc_base.jsonrpc.TransportError:
+            _LOGGER.warning("TransportError trying to add playlist to %s",
+                            self.entity_id)
+
     @asyncio.coroutine
     def async_add_all_albums(self, artist_name):
         """Add all albums of an artist to default playlist (i.e. playlistid=0).
 
-        The artist is specified in terms of name.
+        The artist is specified in terms of name, and the albums are added
+        with one request.
         """
         artist_id = yield from self.async_find_artist(artist_name)
 
         albums = yield from self.async_get_albums(artist_id)
 
-        for alb in albums['albums']:
-            yield from self.server.Playlist.Add(
-                {"playlistid": 0, "item": {"albumid": int(alb['albumid'])}})
+        items = [{"albumid": int(alb['albumid'])}
+                 for alb in albums.get('albums', [])]
+        if items:
+            yield from self._async_playlist_add(items)
 
     @asyncio.coroutine
     def async_clear_playlist(self):
@@ -868,17 +1521,61 @@ class KodiDevice(MediaPlayerDevice):
         return (yield from self.server.AudioLibrary.GetAlbums(
             {"filter": {"artistid": int(artist_id)}}))
 
+    @asyncio.coroutine
+    def async_get_library(self):
+        """Get the music library index, refreshing it when needed."""
+        with (yield from self._library_lock):
+            library = self._library
+            if not library.stale:
+                if self.ws_connected:
+                    return library  # (refreshed with the notifications)
+                if monotonic() - library.updated < LIBRARY_MAX_AGE:
+                    return library
+
+            artists, albums, songs = yield from asyncio.gather(
+                self.server.AudioLibrary.GetArtists(),
+                self.server.AudioLibrary.GetAlbums(
+                    {"properties": ["artistid"]}),
+                self.server.AudioLibrary.GetSongs(
+                    {"properties": ["artistid"]}),
+                loop=self.hass.loop)
+            yield from self.hass.async_add_job(
+                library.load, artists, albums, songs)
+            return library
+
+    @asyncio.coroutine
+    def async_update_library_item(self, item_type, item_id):
+        """Get the details of a library item and update its index entry."""
+        import jsonrpc_base
+        kind, method, id_key = item_type
+        params = {id_key: item_id}
+        if kind != 'artists':  # (the artists are indexed by their own id)
+            params['properties'] = ['artistid']
+        try:
+            result = yield from getattr(
+                self.server.AudioLibrary, method)(params)
+            details = result[id_key[:-2] + 'details']
+        except (jsonrpc_base.jsonrpc.JSONRPCError, KeyError):
+            _LOGGER.debug("Unable to get the details of %s %s",
+                          kind, item_id, exc_info=True)
+            self._library.stale = True
+            return
+
+        with (yield from self._library_lock):
+            if not self._library.stale:
+                self._library.update(
+                    kind, item_id, details['label'],
+                    [item_id] if kind == 'artists'
+                    else details.get('artistid', []))
+
     @asyncio.coroutine
     def async_find_artist(self, artist_name):
         """Find artist by name."""
-        artists = yield from self.async_get_artists()
-        try:
-            out = self._find(
-                artist_name, [a['artist'] for a in artists['artists']])
-            return artists['artists'][out[0][0]]['artistid']
-        except KeyError:
+        library = yield from self.async_get_library()
+        artist_id = library.find('artists', artist_name)
+        if artist_id is None:
             _LOGGER.warning("No artists were found: %s", artist_name)
-            return None
+        return artist_id
 
     @asyncio.coroutine
     def async_get_songs(self, artist_id=None):
@@ -896,12 +1593,8 @@ class KodiDevice(MediaPlayerDevice):
         if artist_name != '':
             artist_id = yield from self.async_find_artist(artist_name)
 
-        songs = yield from self.async_get_songs(artist_id)
-        if songs['limits']['total'] == 0:
-            return None
-
-        out = self._find(song_name, [a['label'] for a in songs['songs']])
-        return songs['songs'][out[0][0]]['songid']
+        library = yield from self.async_get_library()
+        return library.find('songs', song_name, artist_id)
 
     @asyncio.coroutine
     def async_find_album(self, album_name, artist_name=''):
@@ -910,26 +1603,9 @@ class KodiDevice(MediaPlayerDevice):
         if artist_name != '':
             artist_id = yield from self.async_find_artist(artist_name)
 
-        albums = yield from self.async_get_albums(artist_id)
-        try:
-            out = self._find(
-                album_name, [a['label'] for a in albums['albums']])
-            return albums['albums'][out[0][0]]['albumid']
-        except KeyError:
+        library = yield from self.async_get_library()
+        album_id = library.find('albums', album_name, artist_id)
+        if album_id is None:
             _LOGGER.warning("No albums were found with artist: %s, album: %s",
                             artist_name, album_name)
-            return None
-
-    @staticmethod
-    def _find(key_word, words):
-        key_word = key_word.split(' ')
-        patt = [re.compile(
-            '(^| )' + k + '( |$)', re.IGNORECASE) for k in key_word]
-
-        out = [[i, 0] for i in range(len(words))]
-        for i in range(len(words)):
-            mtc = [p.search(words[i]) for p in patt]
-            rate = [m is not None for m in mtc].count(True)
-            out[i][1] = rate
-
-        return sorted(out, key=lambda out: out[1], reverse=True)
+        return album_id
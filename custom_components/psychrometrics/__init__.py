@@ -6,25 +6,29 @@ For more details about this component, please refer to the documentation
 https://home-assistant.io/components/psychrometrics/
 """
 import asyncio
-from collections import deque
 from datetime import timedelta
-from itertools import cycle
+import gzip
+import hashlib
+from itertools import count, cycle
 import json
 from multiprocessing import Process
 import logging
 import os
 from time import time
-from typing import Union, List, Tuple, Optional
+from typing import Optional
 
+from aiohttp import web
 import voluptuous as vol
 
 # TODO Remove TEMPORAL remote access
 from homeassistant import remote
 from homeassistant.components.camera import Camera
+from homeassistant.components.http import HomeAssistantView
+from homeassistant.components.http.const import KEY_AUTHENTICATED
 from homeassistant.const import (
     CONF_NAME, CONF_SCAN_INTERVAL, STATE_ON, STATE_OFF, ATTR_ICON,
     ATTR_FRIENDLY_NAME, ATTR_UNIT_OF_MEASUREMENT, TEMP_CELSIUS,
-    ATTR_DEVICE_CLASS)
+    ATTR_DEVICE_CLASS, EVENT_HOMEASSISTANT_STOP)
 from homeassistant.core import callback
 import homeassistant.helpers.config_validation as cv
 from homeassistant.helpers.discovery import async_load_platform
@@ -33,21 +37,32 @@ from homeassistant.helpers.dispatcher import (
 from homeassistant.helpers.entity import Entity
 from homeassistant.components.binary_sensor import BinarySensorDevice
 from homeassistant.helpers.event import (
-    async_track_time_interval, async_track_point_in_utc_time)
+    async_track_time_interval, async_track_point_in_utc_time,
+    async_track_state_change)
+from homeassistant.util import slugify
 from homeassistant.util.dt import now
 
+from .history import PointsHistory
+from .properties import (
+    psychrometric_properties, pressure_by_altitude, P_ATM_KPA)
+
 REQUIREMENTS = ['psychrochart==0.1.10']
-DEPENDENCIES = ['sensor']
+DEPENDENCIES = ['sensor', 'http']
 
 DOMAIN = 'psychrometrics'
 
 _LOGGER = logging.getLogger(__name__)
 
 CONF_ALTITUDE = 'altitude'
+CONF_CHART = 'chart'
 CONF_EXTERIOR = 'exterior'
 CONF_INTERIOR = 'interior'
 CONF_PRESSURE_KPA = 'pressure_kpa'
+CONF_PRIORITY = 'priority'
+CONF_PROPERTIES = 'properties'
+CONF_PNG_THUMBNAIL = 'png_thumbnail'
 CONF_EVOLUTION_ARROWS_MIN = 'evolution_arrows_minutes'
+CONF_HISTORY_HOURS = 'history_hours'
 CONF_REMOTE_API = 'remote_api'
 CONF_WEATHER = 'weather'
 
@@ -57,34 +72,63 @@ DEFAULT_SCAN_INTERVAL_SEC = 60
 DEFAULT_DEAD_BAND = 0.5  # ºC
 DEFAULT_DELTA_EVOLUTION = 5400  # 1.5h
 DEFAULT_FREQ_SAMPLING_SEC = 300  # 300 (5min)
+DEFAULT_HISTORY_HOURS = 24
+THUMBNAIL_DPI = 40
 
 BINARY_SENSOR_NAME = 'close_house'
 SENSOR_NAME = 'house_delta_temperature'
 
+# Psychrometric properties of each zone, as sensors:
+# name, friendly name, unit, icon, decimals
+PSYCHROMETRIC_PROPERTIES = {
+    'dew_point': ['house_dew_point', "Punto de rocío",
+                  TEMP_CELSIUS, 'mdi:water', 1],
+    'absolute_humidity': ['house_absolute_humidity', "Humedad absoluta",
+                          'g/m³', 'mdi:water-percent', 2],
+    'humidity_ratio': ['house_humidity_ratio', "Humedad específica",
+                       'g/kg', 'mdi:water-percent', 2],
+    'enthalpy': ['house_enthalpy', "Entalpía",
+                 'kJ/kg', 'mdi:thermometer-lines', 1],
+    'wet_bulb': ['house_wet_bulb_temperature', "Temperatura de bulbo húmedo",
+                 TEMP_CELSIUS, 'mdi:thermometer', 1]}
+ZONE_LABELS = {CONF_INTERIOR: "Interior",
+               CONF_EXTERIOR: "Exterior",
+               CONF_WEATHER: "Exterior Est."}
+
 POINT_SCHEMA = vol.Schema(cv.entity_ids)
 POINTS_SCHEMA = vol.Schema(
     vol.Any(POINT_SCHEMA, cv.ensure_list(POINT_SCHEMA)))
 ROOM_SCHEMA = vol.Schema({cv.string: POINTS_SCHEMA})
 
+CHART_SCHEMA = vol.Schema({
+    vol.Required(CONF_INTERIOR): ROOM_SCHEMA,
+    vol.Optional(CONF_EXTERIOR): POINTS_SCHEMA,
+    vol.Optional(CONF_WEATHER): POINTS_SCHEMA,
+    vol.Optional(CONF_NAME, default=DEFAULT_NAME): cv.string,
+    vol.Optional(CONF_SCAN_INTERVAL, default=DEFAULT_SCAN_INTERVAL_SEC):
+        cv.positive_int,
+    vol.Exclusive(CONF_ALTITUDE, 'altitude'): cv.positive_int,
+    vol.Exclusive(CONF_PRESSURE_KPA, 'altitude'): cv.positive_int,
+    vol.Optional(CONF_EVOLUTION_ARROWS_MIN): cv.positive_int,
+    vol.Optional(CONF_HISTORY_HOURS, default=DEFAULT_HISTORY_HOURS):
+        cv.positive_int,
+    vol.Optional(CONF_REMOTE_API): cv.Dict,
+    vol.Optional(CONF_PNG_THUMBNAIL, default=False): cv.boolean,
+    vol.Optional(CONF_PROPERTIES, default=list(PSYCHROMETRIC_PROPERTIES)):
+        vol.All(cv.ensure_list, [vol.In(PSYCHROMETRIC_PROPERTIES)]),
+    vol.Optional(CONF_PRIORITY, default=0): vol.Coerce(int),
+})
+
 CONFIG_SCHEMA = vol.Schema({
-    DOMAIN: vol.Schema({
-        vol.Required(CONF_INTERIOR): ROOM_SCHEMA,
-        vol.Optional(CONF_EXTERIOR): POINTS_SCHEMA,
-        vol.Optional(CONF_WEATHER): POINTS_SCHEMA,
-        vol.Optional(CONF_NAME, default=DEFAULT_NAME): cv.string,
-        vol.Optional(CONF_SCAN_INTERVAL, default=DEFAULT_SCAN_INTERVAL_SEC):
-            cv.positive_int,
-        vol.Exclusive(CONF_ALTITUDE, 'altitude'): cv.positive_int,
-        vol.Exclusive(CONF_PRESSURE_KPA, 'altitude'): cv.positive_int,
-        vol.Optional(CONF_EVOLUTION_ARROWS_MIN): cv.positive_int,
-        vol.Optional(CONF_REMOTE_API): cv.Dict,
-    })
+    DOMAIN: vol.Any(CHART_SCHEMA, vol.All(cv.ensure_list, [CHART_SCHEMA]))
 }, required=True, extra=vol.ALLOW_EXTRA)
 
 basedir = os.path.dirname(os.path.abspath(__file__))
 CHART_STYLE_JSON = os.path.join(basedir, 'chart_style.json')
 OVERLAY_ZONES_JSON = os.path.join(basedir, 'zones_overlay.json')
 CONNECTORS_JSON = os.path.join(basedir, 'connectors.json')
+CHART_SVG_FILE = 'psychrochart{}.svg'
+HISTORY_FILE = '.psychrometrics_history{}.npz'
 POINT_COLORS = cycle([[0.1059, 0.6196, 0.4667, 0.7],
                       [0.851, 0.3725, 0.0078, 0.7],
                       [0.4588, 0.4392, 0.702, 0.7],
@@ -94,11 +138,17 @@ POINT_COLORS = cycle([[0.1059, 0.6196, 0.4667, 0.7],
                       [0.651, 0.4627, 0.1137, 0.7],
                       [0.4, 0.4, 0.4, 0.7]])
 SIGNAL_UPDATE_DATA = DOMAIN + '_update'
+DATA_PSYCHROCAMS = DOMAIN + '_cameras'
+DATA_RENDERER = DOMAIN + '_renderer'
+ATTR_NAME_SUFFIX = 'name_suffix'
+URL_CHART_IMAGE = '/api/psychrometrics/{0}/{1}'
+IMAGE_CHART = 'chart.svg'
+IMAGE_THUMBNAIL = 'thumbnail.png'
 
 
-def make_psychrochart(svg_image,
-                      altitude, pressure_kpa, points, connectors, arrows):
-    """Create the PsychroChart SVG file and save it to disk."""
+def make_psychrochart(svg_image, altitude, pressure_kpa,
+                      points, connectors, arrows, png_thumbnail=None):
+    """Create the PsychroChart SVG file (and PNG thumbnail) in disk."""
     from psychrochart.agg import PsychroChart
     from psychrochart.util import load_config
 
@@ -132,14 +182,87 @@ def make_psychrochart(svg_image,
         frameon=False, fontsize=8, labelspacing=.8, markerscale=.7)
 
     chart.save(svg_image, format='svg')
+    if png_thumbnail is not None:
+        chart.save(png_thumbnail, format='png', dpi=THUMBNAIL_DPI)
     return True
 
 
+def chart_signature(points, arrows):
+    """Quantise points and arrows to the visible resolution of the chart.
+
+    Temperatures are rounded to 0.1 °C and humidities to 1 %, so two sets
+    of points with the same signature produce the same chart.
+    """
+    def _quantise(point):
+        return round(point[0], 1), int(round(point[1]))
+
+    return (tuple((k, _quantise(p)) for k, p in sorted(points.items())),
+            tuple((k, _quantise(a[0]), _quantise(a[1]))
+                  for k, a in sorted(arrows.items())))
+
+
+def apply_chart_style(labeled_points, colors_interior_zones):
+    """Set the marker style and label of each point (or arrow) to plot."""
+    point_styles = {
+        CONF_EXTERIOR: {'marker': 'X', 'markersize': 15,
+                        'color': [0.855, 0.004, 0.278, 0.8],
+                        'label': 'Exterior'},
+        CONF_WEATHER: {'marker': "d", 'markersize': 10,
+                       'color': [0.573, 0.106, 0.318, .5],
+                       'label': 'Weather service'},
+        CONF_INTERIOR: {'marker': '*', 'markersize': 25,
+                        'color': [0.0, 0.502, 0.337, 0.8],
+                        'label': 'Interior'}}
+    for k in point_styles:
+        if k in labeled_points:
+            label = point_styles[k].pop('label')
+            labeled_points[k] = {
+                "xy": labeled_points[k],
+                "style": point_styles[k],
+                "label": label}
+    for k, p_value in labeled_points.items():
+        if not isinstance(p_value, dict):
+            labeled_points[k] = {
+                "xy": labeled_points[k],
+                "style": {'marker': 'o', 'markersize': 10,
+                          'color': colors_interior_zones[k]},
+                "label": k}
+    return labeled_points
+
+
 @asyncio.coroutine
 def async_setup(hass, config_hosts):
     """Setup the Psychrochart Platform."""
     config = config_hosts[DOMAIN]
 
+    # One chart (dict) or multiple independent charts (list)
+    multiple_charts = isinstance(config, list)
+    charts_config = config if multiple_charts else [config]
+    chart_ids = [slugify(chart_config.get(CONF_NAME))
+                 for chart_config in charts_config]
+    if len(set(chart_ids)) != len(chart_ids):
+        _LOGGER.error('Psychrometric charts need unique names: %s', chart_ids)
+        return False
+
+    connectors = yield from hass.async_add_job(
+        json.load, open(CONNECTORS_JSON))
+
+    hass.data[DOMAIN] = {}
+    hass.data[DATA_PSYCHROCAMS] = {}
+    hass.data[DATA_RENDERER] = PsychroChartRenderer(hass)
+    hass.http.register_view(PsychroChartView(hass.data[DATA_PSYCHROCAMS]))
+
+    for chart_id, chart_config in zip(chart_ids, charts_config):
+        suffix = '_{}'.format(chart_id) if multiple_charts else ''
+        yield from async_setup_chart(
+            hass, chart_id, suffix, chart_config, connectors)
+
+    return True
+
+
+@asyncio.coroutine
+def async_setup_chart(hass, chart_id, suffix, config, connectors):
+    """Setup one psychrometric chart, with its camera and sensors."""
     name = config.get(CONF_NAME)
     interior_rooms = config.get(CONF_INTERIOR)
     exterior = config.get(CONF_EXTERIOR)
@@ -148,6 +271,10 @@ def async_setup(hass, config_hosts):
     pressure_kpa = config.get(CONF_PRESSURE_KPA)
     scan_interval = config.get(CONF_SCAN_INTERVAL)
     evolution_arrows_minutes = config.get(CONF_EVOLUTION_ARROWS_MIN)
+    history_hours = config.get(CONF_HISTORY_HOURS)
+    png_thumbnail = config.get(CONF_PNG_THUMBNAIL)
+    properties = config.get(CONF_PROPERTIES)
+    priority = config.get(CONF_PRIORITY)
 
     remote_api_conf = config.get(CONF_REMOTE_API)
 
@@ -155,33 +282,101 @@ def async_setup(hass, config_hosts):
              CONF_EXTERIOR: exterior,
              CONF_WEATHER: weather}
 
-    connectors = yield from hass.async_add_job(
-        json.load, open(CONNECTORS_JSON))
-
     chart_handler = PsychroChartHandler(
         hass, altitude, pressure_kpa, zones, connectors,
-        scan_interval, evolution_arrows_minutes, remote_api_conf)
+        scan_interval, evolution_arrows_minutes, remote_api_conf,
+        properties, history_hours, png_thumbnail,
+        chart_id=chart_id, file_suffix=suffix, priority=priority,
+        renderer=hass.data[DATA_RENDERER])
+    yield from chart_handler.async_restore_history(
+        hass.config.path(HISTORY_FILE.format(suffix)))
 
-    hass.data[DOMAIN] = chart_handler
+    hass.data[DOMAIN][chart_id] = chart_handler
 
     # Todo don't use domain=camera --> make new card (without caption)
-    yield from async_load_platform(hass, 'camera', DOMAIN, {"name": name})
+    yield from async_load_platform(
+        hass, 'camera', DOMAIN, {"name": name, CONF_CHART: chart_id})
 
     conf_sensor = {
-        CONF_NAME: SENSOR_NAME,
+        CONF_NAME: SENSOR_NAME + suffix,
+        CONF_CHART: chart_id,
         ATTR_FRIENDLY_NAME: "Recalentamiento de casa",
         ATTR_UNIT_OF_MEASUREMENT: TEMP_CELSIUS,
         ATTR_ICON: "mdi:thermometer"}
 
     conf_bin = {
-        CONF_NAME: BINARY_SENSOR_NAME,
+        CONF_NAME: BINARY_SENSOR_NAME + suffix,
+        CONF_CHART: chart_id,
         ATTR_FRIENDLY_NAME: "Apertura de ventanas",
         ATTR_DEVICE_CLASS: "opening"}
 
     yield from async_load_platform(hass, 'sensor', DOMAIN, conf_sensor)
     yield from async_load_platform(hass, 'binary_sensor', DOMAIN, conf_bin)
+    if properties:
+        yield from async_load_platform(
+            hass, 'sensor', DOMAIN, {CONF_PROPERTIES: properties,
+                                     CONF_CHART: chart_id,
+                                     ATTR_NAME_SUFFIX: suffix})
 
-    return True
+
+class PsychroChartRenderer:
+    """Render the charts of all the handlers, one after another.
+
+    Render requests are queued by priority (lower first) and processed
+    back to back by one worker, so there are never concurrent matplotlib
+    processes. A new request for a chart already in the queue replaces
+    the data to plot of the pending one.
+    """
+
+    def __init__(self, hass):
+        """Initialize the renderer with an empty priority queue."""
+        self.hass = hass
+        self._queue = asyncio.PriorityQueue()
+        self._counter = count()
+        self._pending = {}
+        self._worker = None
+
+    @callback
+    def async_request_render(self, handler, *args):
+        """Queue a render of the chart of some handler."""
+        if handler.chart_id not in self._pending:
+            self._queue.put_nowait(
+                (handler.priority, next(self._counter), handler))
+        self._pending[handler.chart_id] = args
+        if self._worker is None:
+            self._worker = self.hass.loop.create_task(self._async_worker())
+
+            # noinspection PyUnusedLocal
+            @callback
+            def _async_stop_worker(event):
+                """Cancel the render worker when HA stops."""
+                self._worker.cancel()
+
+            self.hass.bus.async_listen_once(
+                EVENT_HOMEASSISTANT_STOP, _async_stop_worker)
+
+    @asyncio.coroutine
+    def _async_worker(self):
+        """Render the queued charts."""
+        while True:
+            _, _, handler = yield from self._queue.get()
+            args = self._pending.pop(handler.chart_id)
+            tic = time()
+            try:
+                yield from self.hass.async_add_job(
+                    handler.update_chart_overlay, *args)
+            except asyncio.CancelledError:
+                raise
+            except (OSError, ValueError) as exc:
+                _LOGGER.error('Error generating the chart %s: %s',
+                              handler.chart_id, exc)
+                continue
+            except Exception:  # (the worker must keep rendering the charts)
+                _LOGGER.exception('Unexpected error generating the chart %s',
+                                  handler.chart_id)
+                continue
+            _LOGGER.debug('CHART %s generated in %.2f sec',
+                          handler.chart_id, time() - tic)
 
 
 class PsychroChartHandler:
@@ -189,32 +384,71 @@ class PsychroChartHandler:
 
     def __init__(self, hass, altitude, pressure_kpa,
                  zones_sensors, connectors,
-                 refresh_interval, evolution_arrows_minutes, remote_api_conf):
+                 refresh_interval, evolution_arrows_minutes, remote_api_conf,
+                 properties=None, history_hours=DEFAULT_HISTORY_HOURS,
+                 png_thumbnail=False, chart_id=DOMAIN, file_suffix='',
+                 priority=0, renderer=None):
         """Initialize Local File Camera component."""
         self.hass = hass
+        self.chart_id = chart_id
+        self.priority = priority
+        self.signal_update = '{}_{}'.format(SIGNAL_UPDATE_DATA, chart_id)
+        self._renderer = renderer
+        self._svg_image = os.path.join(
+            basedir, CHART_SVG_FILE.format(file_suffix))
         self._last_tile_generation = None
         self._delta_refresh = timedelta(seconds=refresh_interval)
         self._altitude = altitude
         self._pressure_kpa = pressure_kpa
+        if pressure_kpa is not None:
+            self._pressure = pressure_kpa
+        elif altitude is not None:
+            self._pressure = pressure_by_altitude(altitude)
+        else:
+            self._pressure = P_ATM_KPA
+        self._monitored_properties = properties or []
+        self.properties = {}
         self.zones_sensors = zones_sensors
         self.colors_interior_zones = {
             k: next(POINT_COLORS)
             for k in sorted(self.zones_sensors[CONF_INTERIOR])}
         self.connectors = connectors
 
+        self._arrows_window = None
+        history_window = timedelta(hours=history_hours)
         if evolution_arrows_minutes:
-            len_deque = int(timedelta(minutes=evolution_arrows_minutes)
-                            / self._delta_refresh)
-        else:
-            len_deque = 1
-        self.points = deque([], maxlen=len_deque)
+            self._arrows_window = timedelta(minutes=evolution_arrows_minutes)
+            history_window = max(history_window, self._arrows_window)
+        self._history_capacity = int(
+            history_window / self._delta_refresh) + 1
+        self.history = None
         self.svg_image_bytes = None
+        self.svg_image_gzip = None
+        self.svg_image_etag = None
+        self.png_thumbnail_bytes = None
+        self._png_thumbnail = png_thumbnail
+        self._chart_signature = None
 
         self.delta_house = None
         self.open_house = None
         self._deadband = 0.5  # ºC
         self.sensor_attributes = {}
 
+        # Running aggregates of the sensor pairs, updated on state changes
+        self._entity_pairs = {}
+        self._pair_entities = []
+        self._pair_values = []
+        self._group_pairs = {}
+        self._group_parent = {}
+        self._zone_rooms = {}
+        self._agg = {}
+        self._points = {}
+        self._points_order = []
+        self._sensors_update_scheduled = False
+        self._build_aggregation_index()
+        self.history = PointsHistory(
+            self._points_order, self._history_capacity)
+
         # Remote access to sensors in other HA instance
         self.remote_api = None
         if remote_api_conf:
@@ -226,6 +460,13 @@ class PsychroChartHandler:
                 use_ssl=remote_api_conf.get('use_ssl', False))
             assert api.validate_api()
             self.remote_api = api
+        else:
+            for entity_id in self._entity_pairs:
+                self._async_sensor_state_changed(
+                    entity_id, None, self.hass.states.get(entity_id))
+            async_track_state_change(
+                self.hass, list(self._entity_pairs),
+                self._async_sensor_state_changed)
 
         # Chart regeneration
         if self.remote_api is not None:  # No need to wait
@@ -236,111 +477,169 @@ class PsychroChartHandler:
 
     def update_chart_overlay(self, svg_image, points, connectors, arrows):
         """Update the PsychroChart with the sensors info and return the SVG."""
+        png_thumbnail = None
+        if self._png_thumbnail:
+            png_thumbnail = os.path.splitext(svg_image)[0] + '_thumb.png'
         p = Process(target=make_psychrochart,
                     args=(svg_image, self._altitude, self._pressure_kpa,
-                          points, connectors, arrows))
+                          points, connectors, arrows, png_thumbnail))
         p.start()
         p.join()
-        with open(svg_image, 'rb') as f:
-            self.svg_image_bytes = f.read()
+        self.load_chart_files(svg_image, png_thumbnail)
+        self._last_tile_generation = now()
 
-    def _get_sensor_state(self, entity_id, remote_states=None):
+    def load_chart_files(self, svg_image, png_thumbnail=None):
+        """Load the generated chart files.
 
-        def _opt_float(x: str) -> Optional[float]:
-            try:
-                return float(x)
-            except ValueError:
-                return None
+        A gzip variant and a content hash of the SVG are kept
+        for the conditional and compressed serving of the chart.
+        """
+        with open(svg_image, 'rb') as f:
+            svg_image_bytes = f.read()
+        if png_thumbnail is not None:
+            with open(png_thumbnail, 'rb') as f:
+                self.png_thumbnail_bytes = f.read()
+        self.svg_image_gzip = gzip.compress(svg_image_bytes)
+        self.svg_image_etag = hashlib.sha1(svg_image_bytes).hexdigest()
+        self.svg_image_bytes = svg_image_bytes
+
+    def _build_aggregation_index(self):
+        """Map each configured entity to the sensor pairs that use it."""
+        for main_zone, values in self.zones_sensors.items():
+            if not values:
+                continue
+            if isinstance(values, dict):
+                groups = [(room, main_zone, sensors_room)
+                          for room, sensors_room in values.items()]
+                self._zone_rooms[main_zone] = list(values.keys())
+                self._points_order += list(values.keys())
+            else:
+                groups = [(main_zone, None, values)]
+            self._points_order.append(main_zone)
+
+            for group, parent, sensor_list in groups:
+                self._group_pairs[group] = []
+                self._group_parent[group] = parent
+                self._agg[group] = (0, 0, 0)
+                for pair in sensor_list:
+                    pair_key = len(self._pair_values)
+                    self._pair_values.append([None, None])
+                    self._pair_entities.append(pair)
+                    self._group_pairs[group].append(pair_key)
+                    for position, entity_id in enumerate(pair[:2]):
+                        self._entity_pairs.setdefault(entity_id, []).append(
+                            (group, pair_key, position))
+
+    @staticmethod
+    def _opt_float(x: str) -> Optional[float]:
+        try:
+            return float(x)
+        except (TypeError, ValueError):
+            return None
 
-        value = None
-        if remote_states is not None:
-            value = [_opt_float(s.state) for s in
-                     filter(lambda x: x.entity_id == entity_id,
-                            remote_states)]
-            if value:
-                value = value[0]
+    def _set_point(self, group, agg):
+        """Store the (truncated) mean point of a room or zone."""
+        sum_t, sum_h, counter = agg
+        if counter:
+            self._points[group] = (int(100 * sum_t / counter) / 100.,
+                                   int(100 * sum_h / counter) / 100.)
         else:
-            sensor = self.hass.states.get(entity_id)
-            if sensor is not None:
-                value = _opt_float(sensor.state)
-        return value
+            self._points.pop(group, None)
+
+    def _update_zone(self, main_zone):
+        """Aggregate the room means of a main zone."""
+        temp_zone = humid_zone = counter = 0
+        for room in self._zone_rooms[main_zone]:
+            sum_t, sum_h, n_room = self._agg[room]
+            if n_room:
+                temp_zone += sum_t / n_room
+                humid_zone += sum_h / n_room
+                counter += 1
+        self._agg[main_zone] = (temp_zone, humid_zone, counter)
+        self._set_point(main_zone, self._agg[main_zone])
+
+    def _update_group(self, group):
+        """Aggregate the complete sensor pairs of a room or main zone."""
+        sum_t = sum_h = counter = 0
+        for pair_key in self._group_pairs[group]:
+            s_temp, s_humid = self._pair_values[pair_key]
+            if s_temp is not None and s_humid is not None:
+                sum_t += s_temp
+                sum_h += s_humid
+                counter += 1
+        self._agg[group] = (sum_t, sum_h, counter)
+        self._set_point(group, self._agg[group])
+        parent = self._group_parent[group]
+        if parent is not None:
+            self._update_zone(parent)
+
+    def _update_entity_value(self, entity_id, value):
+        """Update the running aggregates with a new sensor value.
+
+        Return True if any point changed."""
+        changed_groups = set()
+        for group, pair_key, position in self._entity_pairs[entity_id]:
+            pair = self._pair_values[pair_key]
+            if pair[position] != value:
+                pair[position] = value
+                changed_groups.add(group)
+                if value is None:
+                    _LOGGER.info('ERROR PAIR: %s -> (%s, %s)',
+                                 self._pair_entities[pair_key], *pair)
+        for group in changed_groups:
+            self._update_group(group)
+        return bool(changed_groups)
+
+    @callback
+    def _async_sensor_state_changed(self, entity_id, old_state, new_state):
+        """Track the state changes of the configured sensors."""
+        value = None
+        if new_state is not None:
+            value = self._opt_float(new_state.state)
+        if self._update_entity_value(entity_id, value):
+            self.async_schedule_sensors_update()
+
+    @callback
+    def async_schedule_sensors_update(self):
+        """Schedule one update of the derived sensors."""
+        if not self._sensors_update_scheduled:
+            self._sensors_update_scheduled = True
+            self.hass.async_add_job(self.update_sensors())
 
     @asyncio.coroutine
     def collect_states(self):
-        """Get states from sensors for each zone/subzone."""
-
-        def _get_sensor_list(sensor_list):
-            sensors_subzone = []
-            for pair in sensor_list:
-                s_temp = self._get_sensor_state(pair[0], remote_states)
-                s_humid = self._get_sensor_state(pair[1], remote_states)
-                if s_temp is not None and s_humid is not None:
-                    sensors_subzone.append((s_temp, s_humid))
-                else:
-                    _LOGGER.info('ERROR PAIR: %s -> (%s, %s)',
-                                 pair, s_temp, s_humid)
-            return sensors_subzone
-
-        remote_states = None
-        if self.remote_api is not None:
-            remote_states = yield from self.hass.async_add_job(
-                remote.get_states, self.remote_api)
-        results = {}
-        for main_zone, values in self.zones_sensors.items():
-            if isinstance(values, list):
-                results[main_zone] = _get_sensor_list(values)
-            else:
-                assert isinstance(values, dict)
-                results[main_zone] = {}
-                for s_zone, sensors_sz in values.items():
-                    results[main_zone][s_zone] = _get_sensor_list(sensors_sz)
-        return results
+        """Refresh the sensor aggregates from the remote HA instance."""
+        remote_states = yield from self.hass.async_add_job(
+            remote.get_states, self.remote_api)
+        for state in remote_states:
+            if state.entity_id in self._entity_pairs:
+                self._update_entity_value(
+                    state.entity_id, self._opt_float(state.state))
+
+    def current_points(self):
+        """Return the aggregated temperature - humidity points."""
+        return {key: self._points[key]
+                for key in self._points_order if key in self._points}
 
     @asyncio.coroutine
     def get_dbt_rh_points(self):
         """Extract temperature - humidity points from sensors."""
-        def _mean(values: Union[List[float],
-                                Tuple[float]]) -> Optional[float]:
-            if values:
-                try:
-                    return sum(values) / len(values)
-                except TypeError:
-                    _LOGGER.error('Bad values in mean: %s', values)
-            return None
-
-        results = yield from self.collect_states()
-        points = {}
-        for key, value in results.items():
-            if isinstance(value, dict):
-                temp_zone = humid_zone = counter = 0
-                for k_room, s_values in value.items():
-                    temp = _mean([v[0] for v in s_values])
-                    humid = _mean([v[1] for v in s_values])
-                    if temp is not None and humid is not None:
-                        points[k_room] = (int(100 * temp) / 100.,
-                                          int(100 * humid) / 100.)
-                        temp_zone += temp
-                        humid_zone += humid
-                        counter += 1
-                if counter:
-                    points[key] = (int(100 * temp_zone / counter) / 100.,
-                                   int(100 * humid_zone / counter) / 100.)
-            else:
-                temp = _mean([v[0] for v in value])
-                humid = _mean([v[1] for v in value])
-                if temp is not None and humid is not None:
-                    points[key] = (int(100 * temp) / 100.,
-                                   int(100 * humid) / 100.)
-        return points
+        if self.remote_api is not None:
+            yield from self.collect_states()
+        return self.current_points()
 
     @asyncio.coroutine
     def update_sensors(self):
         """Update temp and humid sensors to make a new SVG chart."""
-        if not self.points:
+        self._sensors_update_scheduled = False
+        points = self.current_points()
+        if not points:
             return
 
-        points = self.points[-1]
         _LOGGER.debug('POINTS FOR UPD SENSORS: %s', points)
+        if self._monitored_properties:
+            self.update_properties(points)
+
         main_zones = [CONF_INTERIOR, CONF_EXTERIOR, CONF_WEATHER]
         deltas_zones = delta_est = delta_house = None
         temp_int, temp_ext, temp_est = [points[k][0] if k in points else None
@@ -373,6 +672,7 @@ class PsychroChartHandler:
         self.sensor_attributes = attrs
         # Decision logic (deadband)
         if delta_house is None:
+            async_dispatcher_send(self.hass, self.signal_update)
             return
 
         self.delta_house = delta_house
@@ -391,62 +691,87 @@ class PsychroChartHandler:
             _LOGGER.info("Natural ventilation --> ON (∆House: {} ºC)"
                          .format(delta_house))
 
-        async_dispatcher_send(self.hass, SIGNAL_UPDATE_DATA)
+        async_dispatcher_send(self.hass, self.signal_update)
+
+    @asyncio.coroutine
+    def async_restore_history(self, path):
+        """Restore the persisted history of points and save it on stop."""
+        self.history = yield from self.hass.async_add_job(
+            PointsHistory.load, path,
+            self._points_order, self._history_capacity)
+
+        # noinspection PyUnusedLocal
+        @callback
+        def _async_save_history(event):
+            """Persist the history of points when HA stops."""
+            self.hass.async_add_job(self.history.save, path)
+
+        self.hass.bus.async_listen_once(
+            EVENT_HOMEASSISTANT_STOP, _async_save_history)
+
+    def trends(self):
+        """Return the evolution of temperature and humidity of each zone."""
+        if self._arrows_window is None:
+            return {}
+        return self.history.trends(
+            time() - self._arrows_window.total_seconds())
+
+    def update_properties(self, points):
+        """Compute the psychrometric properties of all zones at once."""
+        zones = list(points)
+        values = psychrometric_properties(
+            [points[z][0] for z in zones], [points[z][1] for z in zones],
+            self._pressure)
+        labels = [ZONE_LABELS.get(z, z) for z in zones]
+        self.properties = {}
+        for prop in self._monitored_properties:
+            decimals = PSYCHROMETRIC_PROPERTIES[prop][4]
+            self.properties[prop] = {
+                label: round(float(value), decimals)
+                for label, value in zip(labels, values[prop])}
 
     # noinspection PyUnusedLocal
     @asyncio.coroutine
     def update_chart(self, *args):
         """Re-generates Chart SVG."""
-
-        def _apply_style(labeled_points, colors_interior_zones):
-            point_styles = {
-                CONF_EXTERIOR: {'marker': 'X', 'markersize': 15,
-                                'color': [0.855, 0.004, 0.278, 0.8],
-                                'label': 'Exterior'},
-                CONF_WEATHER: {'marker': "d", 'markersize': 10,
-                               'color': [0.573, 0.106, 0.318, .5],
-                               'label': 'Weather service'},
-                CONF_INTERIOR: {'marker': '*', 'markersize': 25,
-                                'color': [0.0, 0.502, 0.337, 0.8],
-                                'label': 'Interior'}}
-            for k in point_styles:
-                if k in labeled_points:
-                    label = point_styles[k].pop('label')
-                    labeled_points[k] = {
-                        "xy": labeled_points[k],
-                        "style": point_styles[k],
-                        "label": label}
-            for k, p_value in labeled_points.items():
-                if not isinstance(p_value, dict):
-                    labeled_points[k] = {
-                        "xy": labeled_points[k],
-                        "style": {'marker': 'o', 'markersize': 10,
-                                  'color': colors_interior_zones[k]},
-                        "label": k}
-            return labeled_points
-
         tic = time()
         points = yield from self.get_dbt_rh_points()
         _LOGGER.debug('NEW POINTS: %s', points)
 
-        self.points.append(points.copy())
-        yield from self.update_sensors()
+        self.history.append(tic, points)
+        if self.remote_api is not None:
+            yield from self.update_sensors()
 
         arrows = {}
-        if len(self.points) > 1:
-            arrows = {k: [p, self.points[0][k]]
-                      for k, p in points.items() if k in self.points[0]
-                      and p != self.points[0][k]}
+        past_points = None
+        if self._arrows_window is not None:
+            past_points = self.history.points_at(
+                tic - self._arrows_window.total_seconds())
+        if past_points:
+            arrows = {k: [p, past_points[k]]
+                      for k, p in points.items() if k in past_points
+                      and p != past_points[k]}
+
+        signature = chart_signature(points, arrows)
+        if (signature == self._chart_signature
+                and self.svg_image_bytes is not None):
+            _LOGGER.debug('No visible changes, CHART not regenerated')
+            return
+        self._chart_signature = signature
+
+        if arrows:
             _LOGGER.debug('MAKE ARROWS: %s', arrows)
-            arrows = _apply_style(arrows, self.colors_interior_zones)
+            arrows = apply_chart_style(arrows, self.colors_interior_zones)
 
-        points_plot = _apply_style(points, self.colors_interior_zones)
+        points_plot = apply_chart_style(points, self.colors_interior_zones)
 
-        svg_image = os.path.join(basedir, 'psychrochart.svg')
+        if self._renderer is not None:
+            self._renderer.async_request_render(
+                self, self._svg_image, points_plot, self.connectors, arrows)
+            return
         yield from self.hass.async_add_job(
-            self.update_chart_overlay, svg_image,
+            self.update_chart_overlay, self._svg_image,
             points_plot, self.connectors, arrows)
-        self._last_tile_generation = now()
         _LOGGER.debug('CHART generated in {:.2f} sec'.format(time() - tic))
 
 
@@ -461,12 +786,37 @@ class PsychroCam(Camera):
         self._name = entity_name
         self._chart = chart_handler
 
+    @property
+    def chart(self):
+        """Return the chart handler of the camera."""
+        return self._chart
+
     @asyncio.coroutine
     def async_camera_image(self):
         """Return image response."""
         if self._chart.svg_image_bytes is not None:
             return self._chart.svg_image_bytes
 
+    @asyncio.coroutine
+    def async_added_to_hass(self):
+        """Register the camera for the compressed chart view."""
+        self.hass.data[DATA_PSYCHROCAMS][self.entity_id] = self
+
+    @property
+    def entity_picture(self):
+        """Return a link to the compressed and cacheable chart view."""
+        picture = super().entity_picture
+        return picture.replace(
+            '/api/camera_proxy/{}'.format(self.entity_id),
+            URL_CHART_IMAGE.format(self.entity_id, IMAGE_CHART))
+
+    def valid_token(self, token):
+        """Check an access token of the camera."""
+        tokens = getattr(self, 'access_tokens', None)
+        if tokens is None:
+            tokens = [self.access_token]
+        return token is not None and token in tokens
+
     @property
     def name(self):
         """Return the name of this camera."""
@@ -482,16 +832,67 @@ class PsychroCam(Camera):
         """Camera model."""
         return 'Psychrometric chart'
 
-    # @property
-    # def state_attributes(self):
-    #     """Camera state attributes."""
-    #     st_attrs = super().state_attributes
-    #     # st_attrs.update({"friendly_name": self.name,
-    #     #                  "attribution": "Powered by AzogueLabs",
-    #     #                  "last_changed": self._last_tile_generation})
-    #     st_attrs.update({"friendly_name": self.name,
-    #                      "attribution": "Powered by AzogueLabs"})
-    #     return st_attrs
+    @property
+    def state_attributes(self):
+        """Camera state attributes, with the evolution of each zone."""
+        st_attrs = super().state_attributes
+        for zone, (delta_temp, delta_humid) in self._chart.trends().items():
+            st_attrs.update({"∆T {}".format(zone): delta_temp,
+                             "∆HR {}".format(zone): delta_humid})
+        return st_attrs
+
+
+class PsychroChartView(HomeAssistantView):
+    """Serve the psychrometric charts with gzip and ETag validation."""
+
+    url = URL_CHART_IMAGE.format('{entity_id}', '{image}')
+    name = 'api:psychrometrics:image'
+    requires_auth = False
+
+    def __init__(self, cameras):
+        """Initialize the chart view with the registry of cameras."""
+        self._cameras = cameras
+
+    @asyncio.coroutine
+    def get(self, request, entity_id, image):
+        """Return the chart SVG or its PNG thumbnail."""
+        camera = self._cameras.get(entity_id)
+        if camera is None:
+            return web.Response(status=404)
+        if not (request.get(KEY_AUTHENTICATED, False)
+                or camera.valid_token(request.query.get('token'))):
+            return web.Response(status=401)
+
+        chart = camera.chart
+        if chart.svg_image_etag is None:
+            return web.Response(status=503)
+
+        headers = {'Cache-Control': 'no-cache'}
+        etag = chart.svg_image_etag
+        if image == IMAGE_THUMBNAIL:
+            if chart.png_thumbnail_bytes is None:
+                return web.Response(status=404)
+            body, content_type = chart.png_thumbnail_bytes, 'image/png'
+        elif image == IMAGE_CHART:
+            # (one ETag for each encoding of the same SVG)
+            headers['Vary'] = 'Accept-Encoding'
+            content_type = camera.content_type
+            if 'gzip' in request.headers.get('Accept-Encoding', ''):
+                headers['Content-Encoding'] = 'gzip'
+                body, etag = chart.svg_image_gzip, etag + '-gz'
+            else:
+                body = chart.svg_image_bytes
+        else:
+            return web.Response(status=404)
+
+        headers['ETag'] = '"{}"'.format(etag)
+        if_none_match = request.headers.get('If-None-Match', '')
+        if headers['ETag'] in (tag.strip().replace('W/', '', 1)
+                               for tag in if_none_match.split(',')):
+            headers.pop('Content-Encoding', None)
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=body, content_type=content_type,
+                            headers=headers)
 
 
 class PsychrometricsSensor(Entity):
@@ -551,7 +952,34 @@ class PsychrometricsSensor(Entity):
             self.hass.async_add_job(self.async_update_ha_state(True))
 
         async_dispatcher_connect(
-            self.hass, SIGNAL_UPDATE_DATA, async_sensor_update)
+            self.hass, self._chart.signal_update, async_sensor_update)
+
+
+class PsychrometricsPropertySensor(PsychrometricsSensor):
+    """Sensor with one psychrometric property of all rooms and zones."""
+
+    def __init__(self, chart_handler, prop, name, friendly_name, unit, icon):
+        """Initialize the psychrometric property sensor object."""
+        super().__init__(chart_handler, name, friendly_name, unit, icon)
+        self._property = prop
+
+    @property
+    def state(self):
+        """Return the state of the sensor (value for the interior)."""
+        return self._chart.properties.get(
+            self._property, {}).get(ZONE_LABELS[CONF_INTERIOR])
+
+    @property
+    def available(self):
+        """Return true when state is known."""
+        return self.state is not None
+
+    @property
+    def device_state_attributes(self):
+        """Return the state attributes (values for each room and zone)."""
+        attrs = self._chart.properties.get(self._property, {}).copy()
+        attrs.update({"friendly_name": self._friendly_name})
+        return attrs
 
 
 class PsychrometricsBinarySensor(BinarySensorDevice):
@@ -609,4 +1037,4 @@ class PsychrometricsBinarySensor(BinarySensorDevice):
             self.hass.async_add_job(self.async_update_ha_state(True))
 
         async_dispatcher_connect(
-            self.hass, SIGNAL_UPDATE_DATA, async_sensor_update)
+            self.hass, self._chart.signal_update, async_sensor_update)
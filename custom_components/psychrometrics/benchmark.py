@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the psychrometric chart generation.
+
+Synthesises N rooms with M (temperature, humidity) sensor pairs each (plus
+the exterior and weather zones), with evolution arrows, and measures the
+latency and the peak allocations (tracemalloc) of each stage of the chart
+generation with repeated runs:
+  - collection: state changes of all sensors, processed by the handler.
+  - aggregation: `get_dbt_rh_points`, with the mean points of each zone.
+  - sensors: `update_sensors`, with the derived sensors and properties.
+  - style: `apply_chart_style` for the points and arrows.
+  - render: `make_psychrochart` (in process, not in a subprocess).
+  - io: load of the generated SVG, with its gzip variant and hash.
+
+Run it from the HA config directory (in the HA virtualenv) with:
+```
+    python -m custom_components.psychrometrics.benchmark --rooms 10 --pairs 2
+```
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import tempfile
+import tracemalloc
+from time import perf_counter, time
+
+from homeassistant.core import HomeAssistant
+
+from . import (
+    CONF_INTERIOR, CONF_EXTERIOR, CONF_WEATHER, CONNECTORS_JSON,
+    PSYCHROMETRIC_PROPERTIES, PsychroChartHandler, apply_chart_style,
+    make_psychrochart)
+
+STAGES = ['collection', 'aggregation', 'sensors', 'style', 'render', 'io']
+
+
+def _peak_rss_mb():
+    """Return the peak RSS (MB) of this process."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def make_zones(n_rooms, n_pairs):
+    """Make the zones config with synthetic sensor pairs."""
+    def _pairs(prefix):
+        return [['sensor.{}_{}_temperature'.format(prefix, i),
+                 'sensor.{}_{}_humidity'.format(prefix, i)]
+                for i in range(n_pairs)]
+
+    return {CONF_INTERIOR: {'Room {}'.format(r): _pairs('room_{}'.format(r))
+                            for r in range(n_rooms)},
+            CONF_EXTERIOR: _pairs('exterior'),
+            CONF_WEATHER: _pairs('weather')}
+
+
+def set_random_states(hass, zones):
+    """Set random temperature and humidity states for all the sensors."""
+    pairs = [pair for room in zones[CONF_INTERIOR].values() for pair in room]
+    pairs += zones[CONF_EXTERIOR] + zones[CONF_WEATHER]
+    for entity_temp, entity_humid in pairs:
+        hass.states.async_set(
+            entity_temp, round(random.uniform(15, 30), 1))
+        hass.states.async_set(
+            entity_humid, round(random.uniform(30, 70), 1))
+
+
+@asyncio.coroutine
+def run_benchmark(hass, args, svg_image):
+    """Run all the stages `args.repeat` times and return the timings."""
+    with open(CONNECTORS_JSON) as f:
+        connectors = json.load(f)
+    zones = make_zones(args.rooms, args.pairs)
+    handler = PsychroChartHandler(
+        hass, args.altitude, None, zones, connectors, 60,
+        args.arrows_minutes, None, list(PSYCHROMETRIC_PROPERTIES))
+    set_random_states(hass, zones)
+    yield from hass.async_block_till_done()
+
+    # Past points for the evolution arrows
+    past_points = {zone: (round(t - random.uniform(-2, 2), 2), round(h, 2))
+                   for zone, (t, h) in handler.current_points().items()}
+    handler.history.append(time() - 60 * args.arrows_minutes, past_points)
+
+    timings = {stage: [] for stage in STAGES}
+    peak_alloc = {stage: 0 for stage in STAGES}
+
+    def _start():
+        tracemalloc.start()
+        return perf_counter()
+
+    def _stop(stage, tic):
+        timings[stage].append(perf_counter() - tic)
+        peak = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        tracemalloc.stop()
+        peak_alloc[stage] = max(peak_alloc[stage], peak)
+
+    for _ in range(args.repeat):
+        tic = _start()
+        set_random_states(hass, zones)
+        yield from hass.async_block_till_done()
+        _stop('collection', tic)
+
+        tic = _start()
+        points = yield from handler.get_dbt_rh_points()
+        _stop('aggregation', tic)
+
+        tic = _start()
+        yield from handler.update_sensors()
+        _stop('sensors', tic)
+
+        tic = _start()
+        handler.history.append(time(), points)
+        past = handler.history.points_at(time() - 60 * args.arrows_minutes)
+        arrows = {k: [p, past[k]] for k, p in points.items()
+                  if k in past and p != past[k]}
+        arrows = apply_chart_style(arrows, handler.colors_interior_zones)
+        points_plot = apply_chart_style(
+            points, handler.colors_interior_zones)
+        _stop('style', tic)
+
+        tic = _start()
+        make_psychrochart(svg_image, args.altitude, None,
+                          points_plot, connectors, arrows)
+        _stop('render', tic)
+
+        tic = _start()
+        handler.load_chart_files(svg_image)
+        _stop('io', tic)
+
+    return timings, peak_alloc, len(handler.svg_image_bytes)
+
+
+def main():
+    """Parse the CLI arguments, run the benchmark and report the results."""
+    parser = argparse.ArgumentParser(
+        description='Benchmark of the psychrometric chart generation')
+    parser.add_argument('--rooms', type=int, default=5,
+                        help='Number of interior rooms')
+    parser.add_argument('--pairs', type=int, default=1,
+                        help='Number of sensor pairs in each room or zone')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of repeated runs of each stage')
+    parser.add_argument('--arrows-minutes', type=int, default=240,
+                        help='Evolution window for the arrows')
+    parser.add_argument('--altitude', type=int, default=500,
+                        help='Altitude in m')
+    args = parser.parse_args()
+
+    loop = asyncio.get_event_loop()
+    hass = HomeAssistant(loop)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        hass.config.config_dir = tmp_dir
+        svg_image = os.path.join(tmp_dir, 'psychrochart.svg')
+        timings, peak_alloc, svg_size = loop.run_until_complete(
+            run_benchmark(hass, args, svg_image))
+    loop.run_until_complete(hass.async_stop())
+
+    print('Psychrochart benchmark: {} rooms x {} sensor pairs, {} runs '
+          '(SVG of {:.1f} KB, peak RSS of {:.1f} MB)'.format(
+              args.rooms, args.pairs, args.repeat, svg_size / 1024,
+              _peak_rss_mb()))
+    print('{:<12} {:>10} {:>10} {:>10} {:>16}'.format(
+        'stage', 'min [ms]', 'mean [ms]', 'max [ms]', 'peak alloc [MB]'))
+    for stage in STAGES:
+        values = [1000 * t for t in timings[stage]]
+        print('{:<12} {:>10.3f} {:>10.3f} {:>10.3f} {:>16.2f}'.format(
+            stage, min(values), sum(values) / len(values), max(values),
+            peak_alloc[stage]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Rolling history of the psychrometric points for the Psychrometrics component.
+
+The (temperature, humidity) points of each room and zone are stored in a
+time-indexed columnar ring buffer (one timestamp column and one NumPy array
+with shape (capacity, n_zones, 2)), which is persisted to disk on shutdown
+and restored on startup.
+"""
+import logging
+import os
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class PointsHistory:
+    """Time-indexed ring buffer with the points of each zone."""
+
+    def __init__(self, zones, capacity):
+        """Initialize an empty buffer for `capacity` samples."""
+        import numpy as np
+
+        self.zones = list(zones)
+        self._zone_index = {z: i for i, z in enumerate(self.zones)}
+        self.capacity = max(2, capacity)
+        self._ts = np.full(self.capacity, np.nan)
+        self._values = np.full((self.capacity, len(self.zones), 2), np.nan)
+        self._next = 0
+        self._size = 0
+
+    def __len__(self):
+        """Return the number of stored samples."""
+        return self._size
+
+    def append(self, timestamp, points):
+        """Store the points of all zones at some timestamp (epoch seconds)."""
+        import numpy as np
+
+        self._ts[self._next] = timestamp
+        row = self._values[self._next]
+        row[:] = np.nan
+        for zone, point in points.items():
+            idx = self._zone_index.get(zone)
+            if idx is not None:
+                row[idx] = point
+        self._next = (self._next + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+
+    def _ordered_rows(self):
+        """Return the physical row indexes sorted from oldest to newest."""
+        import numpy as np
+
+        start = (self._next - self._size) % self.capacity
+        return (start + np.arange(self._size)) % self.capacity
+
+    @property
+    def timestamps(self):
+        """Return the sample timestamps, from oldest to newest."""
+        return self._ts[self._ordered_rows()]
+
+    @property
+    def values(self):
+        """Return the zone points, shape (n_samples, n_zones, 2)."""
+        return self._values[self._ordered_rows()]
+
+    def _row_at(self, timestamp):
+        """Return the row of the last sample at or before some timestamp.
+
+        If there is no sample so old, the oldest one is used.
+        """
+        import numpy as np
+
+        rows = self._ordered_rows()
+        pos = np.searchsorted(self._ts[rows], timestamp, side='right') - 1
+        return rows[max(0, pos)]
+
+    def _row_to_points(self, row):
+        import numpy as np
+
+        values = self._values[row]
+        return {zone: (float(values[i, 0]), float(values[i, 1]))
+                for i, zone in enumerate(self.zones)
+                if not np.isnan(values[i]).any()}
+
+    def points_at(self, timestamp):
+        """Return the points of the last sample at or before some timestamp.
+
+        None is returned when there are less than two samples stored.
+        """
+        if self._size < 2:
+            return None
+        return self._row_to_points(self._row_at(timestamp))
+
+    def trends(self, timestamp):
+        """Return the change of each zone point since some timestamp.
+
+        :return: dict with (∆temperature, ∆humidity) for each zone.
+        """
+        import numpy as np
+
+        if self._size < 2:
+            return {}
+        last = self._values[(self._next - 1) % self.capacity]
+        delta = last - self._values[self._row_at(timestamp)]
+        return {zone: (round(float(delta[i, 0]), 2),
+                       round(float(delta[i, 1]), 2))
+                for i, zone in enumerate(self.zones)
+                if not np.isnan(delta[i]).any()}
+
+    def save(self, path):
+        """Persist the stored samples to a compressed NumPy file."""
+        import numpy as np
+
+        with open(path, 'wb') as f:
+            np.savez_compressed(
+                f, timestamps=self.timestamps, values=self.values,
+                zones=np.array(self.zones))
+        _LOGGER.debug('Saved %d psychrometric samples in %s',
+                      self._size, path)
+
+    @classmethod
+    def load(cls, path, zones, capacity):
+        """Create a buffer restoring the samples persisted in `path`.
+
+        Zones are matched by name, so the history survives changes in the
+        configuration of rooms.
+        """
+        import numpy as np
+
+        history = cls(zones, capacity)
+        if not os.path.exists(path):
+            return history
+        try:
+            with np.load(path) as data:
+                timestamps = data['timestamps']
+                values = data['values']
+                stored_zones = list(data['zones'])
+        except (OSError, ValueError, KeyError) as exc:
+            _LOGGER.warning('Bad psychrometric history in %s: %s', path, exc)
+            return history
+
+        columns = [(history._zone_index[z], i)
+                   for i, z in enumerate(stored_zones)
+                   if z in history._zone_index]
+        for timestamp, row in zip(timestamps[-history.capacity:],
+                                  values[-history.capacity:]):
+            history._ts[history._next] = timestamp
+            history._values[history._next] = np.nan
+            for idx_new, idx_stored in columns:
+                history._values[history._next, idx_new] = row[idx_stored]
+            history._next = (history._next + 1) % history.capacity
+            history._size = min(history._size + 1, history.capacity)
+        _LOGGER.debug('Restored %d psychrometric samples from %s',
+                      history._size, path)
+        return history
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorised psychrometric equations for the Psychrometrics component.
+
+All the properties of a set of (dry bulb temperature, relative humidity)
+points are computed at once with NumPy arrays, using the equations of the
+ASHRAE Handbook - Fundamentals (2009), chapter 1.
+"""
+import math
+
+P_ATM_KPA = 101.325
+
+# Hyland & Wexler coefficients for the saturation pressure (Pa)
+_C_ICE = (-5.6745359e3, 6.3925247, -9.677843e-3, 6.2215701e-7,
+          2.0747825e-9, -9.484024e-13, 4.1635019)
+_C_WATER = (-5.8002206e3, 1.3914993, -4.8640239e-2, 4.1764768e-5,
+            -1.4452093e-8, 6.5459673)
+
+WET_BULB_ITERATIONS = 30
+
+
+def pressure_by_altitude(altitude_m):
+    """Return the standard atmospheric pressure (kPa) at some altitude."""
+    return P_ATM_KPA * math.pow(1 - 2.25577e-5 * altitude_m, 5.2559)
+
+
+def saturation_pressure(dry_temp_c):
+    """Return the saturation pressure of water vapour (kPa) (vectorised)."""
+    import numpy as np
+
+    temp_k = np.asarray(dry_temp_c, dtype=float) + 273.15
+    log_t = np.log(temp_k)
+    ln_p_ice = (_C_ICE[0] / temp_k + _C_ICE[1] + _C_ICE[2] * temp_k
+                + _C_ICE[3] * temp_k ** 2 + _C_ICE[4] * temp_k ** 3
+                + _C_ICE[5] * temp_k ** 4 + _C_ICE[6] * log_t)
+    ln_p_water = (_C_WATER[0] / temp_k + _C_WATER[1] + _C_WATER[2] * temp_k
+                  + _C_WATER[3] * temp_k ** 2 + _C_WATER[4] * temp_k ** 3
+                  + _C_WATER[5] * log_t)
+    return np.exp(np.where(temp_k < 273.15, ln_p_ice, ln_p_water)) / 1000.
+
+
+def humidity_ratio(p_vapour_kpa, pressure_kpa):
+    """Return the humidity ratio (kg water / kg dry air) (vectorised)."""
+    return 0.621945 * p_vapour_kpa / (pressure_kpa - p_vapour_kpa)
+
+
+def dew_point_temperature(p_vapour_kpa):
+    """Return the dew point temperature (°C) (vectorised)."""
+    import numpy as np
+
+    alpha = np.log(p_vapour_kpa)
+    dew_point = (6.54 + 14.526 * alpha + 0.7389 * alpha ** 2
+                 + 0.09486 * alpha ** 3
+                 + 0.4569 * np.power(p_vapour_kpa, 0.1984))
+    dew_point_ice = 6.09 + 12.608 * alpha + 0.4959 * alpha ** 2
+    return np.where(dew_point < 0, dew_point_ice, dew_point)
+
+
+def wet_bulb_temperature(dry_temp_c, w_kg_kg, dew_point_c, pressure_kpa):
+    """Return the thermodynamic wet bulb temperature (°C) (vectorised).
+
+    The psychrometric equation is solved by bisection between the dew
+    point and the dry bulb temperature, for all points at the same time.
+    """
+    import numpy as np
+
+    t_low = np.minimum(dew_point_c, dry_temp_c)
+    t_high = np.array(dry_temp_c, dtype=float)
+    for _ in range(WET_BULB_ITERATIONS):
+        t_wet = (t_low + t_high) / 2
+        w_sat = humidity_ratio(saturation_pressure(t_wet), pressure_kpa)
+        w_est = (((2501 - 2.326 * t_wet) * w_sat
+                  - 1.006 * (dry_temp_c - t_wet))
+                 / (2501 + 1.86 * dry_temp_c - 4.186 * t_wet))
+        too_hot = w_est > w_kg_kg
+        t_high = np.where(too_hot, t_wet, t_high)
+        t_low = np.where(too_hot, t_low, t_wet)
+    return (t_low + t_high) / 2
+
+
+def psychrometric_properties(dry_temps, rel_humids, pressure_kpa=P_ATM_KPA):
+    """Compute the psychrometric properties of a set of points at once.
+
+    :param dry_temps: sequence of dry bulb temperatures, in °C.
+    :param rel_humids: sequence of relative humidities, in %.
+    :param pressure_kpa: atmospheric pressure, in kPa.
+    :return: dict of arrays with the dew point (°C), the absolute humidity
+    (g/m³), the humidity ratio (g/kg), the enthalpy (kJ/kg) and the wet bulb
+    temperature (°C) of each point.
+    """
+    import numpy as np
+
+    dry_temps = np.asarray(dry_temps, dtype=float)
+    rel_humids = np.clip(np.asarray(rel_humids, dtype=float), 0.1, 100.)
+    p_vapour = rel_humids / 100. * saturation_pressure(dry_temps)
+    w_kg_kg = humidity_ratio(p_vapour, pressure_kpa)
+    dew_point = dew_point_temperature(p_vapour)
+    return {
+        'dew_point': dew_point,
+        'absolute_humidity': 1e6 * p_vapour / (461.5 * (dry_temps + 273.15)),
+        'humidity_ratio': 1000. * w_kg_kg,
+        'enthalpy': 1.006 * dry_temps + w_kg_kg * (2501 + 1.86 * dry_temps),
+        'wet_bulb': wet_bulb_temperature(
+            dry_temps, w_kg_kg, dew_point, pressure_kpa)}
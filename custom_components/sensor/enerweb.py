@@ -6,50 +6,97 @@ It updates sensor last values accessing them directly via remote MYSQL DB.
 ```
     SQL_ALCHEMY URI: mysql+cymysql://{}:{}@{}/data_enerweb
 
-    SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_NAME = "{}"
-    SELECT * FROM {} ORDER BY ID DESC LIMIT {}
+    SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table
+    SELECT {columns} FROM {} WHERE id > :last_id ORDER BY id DESC LIMIT {}
 ```
+
+Only the rows with an `id` greater than the last one seen in each table are
+fetched, so polls without new measurements are index-only no-ops.
+The columns of each table are discovered once, in the first update.
+
+With `backend: http` (or without MySQL credentials) the sensors are updated
+with the enerweb API (`/enerweb/get_sensors_info`) instead, and with
+`backend: auto` (default) the API is used while the MySQL DB is unreachable.
+
+The heating state estimator replays the last `heater_backfill_hours` of
+supply, return and reference temperatures on startup (one `UNION ALL` query),
+to restore its state and the heating cycles and on-time of the last days.
 """
 import asyncio
 from collections import deque
-from functools import partial
 from datetime import timedelta
 import logging
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.exc import (OperationalError, InternalError,
-                            TimeoutError, SQLAlchemyError)
+from operator import itemgetter
+from time import time
 import voluptuous as vol
 
 from homeassistant.components.sensor import PLATFORM_SCHEMA
 from homeassistant.const import (CONF_HOST, TEMP_CELSIUS, CONF_SENSORS,
                                  CONF_TIMEOUT, CONF_NAME,
-                                 STATE_UNKNOWN, STATE_ON, STATE_OFF)
+                                 STATE_UNKNOWN, STATE_ON, STATE_OFF,
+                                 EVENT_HOMEASSISTANT_STOP)
+from homeassistant.core import callback
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
 import homeassistant.helpers.config_validation as cv
+from homeassistant.helpers.dispatcher import (
+    async_dispatcher_connect, async_dispatcher_send)
 from homeassistant.helpers.entity import Entity
-from homeassistant.helpers.event import (async_track_time_interval,
-                                         async_track_point_in_utc_time)
+from homeassistant.helpers.event import async_track_point_in_utc_time
 from homeassistant.util import slugify
-from homeassistant.util.dt import now
+from homeassistant.util.dt import as_local, now
 
 _LOGGER = logging.getLogger(__name__)
-REQUIREMENTS = ['sqlalchemy']
+REQUIREMENTS = ['sqlalchemy>=1.2', 'numpy>=1.13']
 
+CONF_BACKEND = 'backend'
+CONF_BACKFILL_HOURS = 'heater_backfill_hours'
+CONF_MIN_INTERVAL = 'min_scan_interval'
+CONF_MAX_INTERVAL = 'max_scan_interval'
 CONF_ROUND = 'round'
 CONF_MYSQL_USER = 'mysql_user'
 CONF_MYSQL_PASS = 'mysql_password'
 DEFAULT_NAME = 'enerweb'
 DEFAULT_TIMEOUT = 10
+DEFAULT_BACKFILL_HOURS = 24
+HEATING_HISTORY_DAYS = 7
+
+# Data backends (`auto` uses the enerweb API while MySQL is unreachable)
+BACKEND_AUTO = 'auto'
+BACKEND_MYSQL = 'mysql'
+BACKEND_HTTP = 'http'
+MYSQL_RETRY_SEC = 600
 
 URL_MASK_ENERWEB_GET_DATA = 'http://{}/enerweb/get_sensors_info?samples=1'
 URL_MASK_ENERWEB_GET_DATA_MYSQL = 'mysql://{}:{}@{}/data_enerweb'
 SQLMASK_SELECT_TABLE_COLUMN_NAMES = 'SELECT COLUMN_NAME FROM ' \
                                     'INFORMATION_SCHEMA.COLUMNS ' \
-                                    'WHERE TABLE_NAME = \"{}\"'
-SQLMASK_SELECT_TABLE_LAST_VALUES = 'SELECT * FROM {} ORDER BY ID DESC LIMIT {}'
+                                    'WHERE TABLE_SCHEMA = DATABASE() ' \
+                                    'AND TABLE_NAME = :table ' \
+                                    'ORDER BY ORDINAL_POSITION'
+SQLMASK_SELECT_HISTORY = 'SELECT ts, {} AS idx, {} AS value FROM {} ' \
+                         'WHERE ts > :since'
+SQLMASK_SELECT_TABLE_LAST_VALUES = 'SELECT {} FROM {} WHERE id > :last_id ' \
+                                   'ORDER BY id DESC LIMIT {}'
 
+# Adaptive polling: the interval is set to the minimum while the heating
+# supply or return temperatures change fast (or the heater is starting), and
+# it is increased (x1.5) up to the maximum while they are flat. Their rates of
+# change (°C/min) are taken over the time between their last readings.
 SCAN_INTERVAL = timedelta(seconds=40)
+DEFAULT_MIN_INTERVAL = 10
+DEFAULT_MAX_INTERVAL = 120
+INTERVAL_BACKOFF = 1.5
+FAST_CHANGE_RATE = 1.
+FLAT_CHANGE_RATE = .2
 
+# SQL connection pool (one connection per table, kept between updates)
+POOL_MAX_OVERFLOW = 1
+POOL_RECYCLE_SEC = 3600
+
+SIGNAL_UPDATE_ENERWEB = 'enerweb_update_{}'
+
+KEY_ID = 'id'
 KEY_TIMESTAMP = 'ts'
 SENSOR_TYPES_UNITS = {
     'ds18b20': ['temperature', TEMP_CELSIUS],
@@ -64,25 +111,25 @@ JSON_MYSQL_TRANSLATION = {
     'dht22': ['measuredht22', {'temp': 'temperature', 'hum': 'humidity'}],
     'dht11': ['measuredht11', {'temp': 'temperature', 'hum': 'humidity'}],
     'rpi2': ['hostmeasure', {'rpit': 'rpi_temp_cpu', 'temp': 'sense_temp',
-                             'tempp': 'sense_tempp', 'pres': 'sense_press',
+                             'tempp': 'sense_tempp', 'pres': 'sense_pres',
                              'hr': 'sense_hr'}]}
 
-SQL_COLUMNS_TABLES = {
-    'dht22': ('id', 'ts', 'temperature', 'humidity', 'exec_id'),
-    'ds18b20': ('id', 'ts', 'temperature', 'sensor_id'),
-    'rpi2': ('id', 'ts', 'rpi_temp_cpu', 'sensehat', 'sense_temp',
-             'sense_pres', 'sense_hr', 'sense_tempp', 'exec_id')
-}
-
 PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
     vol.Required(CONF_HOST): cv.string,
     vol.Required(CONF_SENSORS): vol.All(cv.ensure_list, [cv.ensure_list]),
     vol.Optional(CONF_NAME, default=DEFAULT_NAME): cv.string,
     vol.Optional(CONF_TIMEOUT, default=DEFAULT_TIMEOUT): cv.positive_int,
-    # vol.Optional(CONF_SCAN_INTERVAL): cv.positive_int,
+    vol.Optional(CONF_BACKFILL_HOURS, default=DEFAULT_BACKFILL_HOURS):
+        cv.positive_int,
+    vol.Optional(CONF_MIN_INTERVAL, default=DEFAULT_MIN_INTERVAL):
+        cv.positive_int,
+    vol.Optional(CONF_MAX_INTERVAL, default=DEFAULT_MAX_INTERVAL):
+        cv.positive_int,
     vol.Optional(CONF_MYSQL_USER, default=None): cv.string,
     vol.Optional(CONF_MYSQL_PASS, default=None): cv.string,
     vol.Optional(CONF_ROUND, default=None): cv.positive_int,
+    vol.Optional(CONF_BACKEND, default=BACKEND_AUTO):
+        vol.In([BACKEND_AUTO, BACKEND_MYSQL, BACKEND_HTTP]),
 })
 
 # Heating system states:
@@ -98,6 +145,8 @@ D_STATES_HEATING = {STATE_HEATING_UNKNOWN: STATE_UNKNOWN,
                     STATE_HEATING_ON: STATE_ON,
                     STATE_HEATING_STOP: 'Parada',
                     STATE_HEATING_RESTART: 'Rearranque'}
+HEATING_ON_STATES = (STATE_HEATING_COLD_START, STATE_HEATING_ON,
+                     STATE_HEATING_RESTART)
 
 
 # noinspection PyUnusedLocal
@@ -108,13 +157,16 @@ def async_setup_platform(hass, config, async_add_devices, discovery_info=None):
     sensors_append = config[CONF_SENSORS]
     name = config[CONF_NAME]
     timeout = config[CONF_TIMEOUT]
-    # scan_interval = config[CONF_SCAN_INTERVAL]
+    min_interval = config[CONF_MIN_INTERVAL]
+    max_interval = max(min_interval, config[CONF_MAX_INTERVAL])
     round_result = config[CONF_ROUND]
 
     # MySQL remote access (vs requests to enerweb API)
     mysql_user = config[CONF_MYSQL_USER]
     mysql_pass = config[CONF_MYSQL_PASS]
-    use_mysql = mysql_user is not None
+    backend = config[CONF_BACKEND]
+    if mysql_user is None:
+        backend = BACKEND_HTTP
     time_zone = hass.config.time_zone
 
     # Monitored enerweb sensors
@@ -136,8 +188,9 @@ def async_setup_platform(hass, config, async_add_devices, discovery_info=None):
     if dev:
         data_handler = yield from hass.async_add_job(
             EnerwebData, hass, enerweb_host, dev, time_zone,
-            timeout, mysql_user, mysql_pass)
-        sensors = [EnerwebSensor(data_handler, use_mysql, name, s_type,
+            timeout, mysql_user, mysql_pass, backend,
+            min_interval, max_interval)
+        sensors = [EnerwebSensor(data_handler, name, s_type,
                                  s_mag, s_name, s_unit, s_class, round_r)
                    for s_type, s_mag, s_name, s_unit, s_class, round_r in dev]
 
@@ -151,7 +204,8 @@ def async_setup_platform(hass, config, async_add_devices, discovery_info=None):
             lambda x: 'dht22' in x.name.lower()
                       and x.unit_of_measurement == TEMP_CELSIUS, sensors))[0]
         # noinspection PyTypeChecker
-        sensors.append(EnerwebHeaterState(data_handler, s_imp, s_ret, s_ref))
+        sensors.append(EnerwebHeaterState(data_handler, s_imp, s_ret, s_ref,
+                                          config[CONF_BACKFILL_HOURS]))
         async_add_devices(sensors)
     else:
         return False
@@ -160,14 +214,14 @@ def async_setup_platform(hass, config, async_add_devices, discovery_info=None):
 class EnerwebSensor(Entity):
     """Representation of a Enerweb sensor."""
 
-    def __init__(self, data_handler, use_mysql, name,
+    def __init__(self, data_handler, name,
                  sensor_type, sensor_mag, sensor_friendly_name,
                  sensor_unit, sensor_class, round_result=None):
         """Initialize the sensor."""
         self._data = data_handler
         self._sensor_type = sensor_type
         self._sensor_mag = sensor_mag
-        self._use_mysql = use_mysql
+        self.sensor_key = (sensor_type, sensor_mag)
         self._mag_is_id = self._sensor_type.startswith('ds18b20')
         self.friendly_name = sensor_friendly_name
         self.sensor_class = sensor_class
@@ -179,8 +233,8 @@ class EnerwebSensor(Entity):
         self._unit_of_measurement = sensor_unit
         self._state = None
         self._last_update = None
-        self._round = round_result
-        self.async_update()
+        self.round_result = round_result
+        self.update_state()
 
     @property
     def name(self):
@@ -197,50 +251,245 @@ class EnerwebSensor(Entity):
         """Return the unit the value is expressed in."""
         return self._unit_of_measurement
 
+    @property
+    def last_update(self):
+        """Return the timestamp of the last measurement."""
+        return self._last_update
+
+    @property
+    def should_poll(self):
+        """Return True if entity has to be polled for state."""
+        return False
+
+    def update_state(self):
+        """Update the state with the data handler value of the sensor."""
+        ts_value = self._data.sensor_values.get(self.sensor_key)
+        if ts_value is None or ts_value[1] is None:
+            return
+        self._last_update, self._state = ts_value
+        if self.round_result is not None:
+            self._state = round(self._state, self.round_result)
+        _LOGGER.debug('New state in {} [{}, {}]'.format(
+            self._name, self._state, self._last_update))
+
     @asyncio.coroutine
-    def async_update(self):
-        """Get the latest data and updates the states."""
-        # self._data.async_update()
-        if self._data.last_sensor_data is not None:
-            try:
-                key_stype = self._sensor_type
-                if not self._use_mysql:
-                    key_stype += '_data'
-                sensor_data = self._data.last_sensor_data[key_stype]
-                if self._use_mysql and sensor_data:
-                    self._last_update = sensor_data[KEY_TIMESTAMP]
-                    self._state = sensor_data[self._sensor_mag]
-                elif sensor_data:
-                    if self._mag_is_id:
-                        data_entity = list(filter(
-                            lambda x: self._sensor_mag in x.values(),
-                            sensor_data))
-                        if data_entity:
-                            self._last_update = data_entity[0][KEY_TIMESTAMP]
-                            self._state = data_entity[0]['temp']
-                        else:
-                            _LOGGER.warning('No data_entity in update sensor by'
-                                            ' id. Data:{}'.format(sensor_data))
-                            return
-                    else:
-                        data_entity = sensor_data[0]
-                        self._last_update = data_entity[KEY_TIMESTAMP]
-                        self._state = data_entity[self._sensor_mag]
-            except KeyError as e:
-                _LOGGER.warning('KeyError: {}. No UPDATE OF {}'
-                                .format(e, self._name))
-                return
-        if (self._round is not None) and (self._state is not None):
-            self._state = round(self._state, self._round)
-            _LOGGER.debug('New state in {} [{}]'.format(self._name,
-                          self._state, self._last_update))
+    def async_added_to_hass(self):
+        """Register update dispatcher."""
+        @callback
+        def async_sensor_update(changed_keys):
+            """Update callback (only when the sensor value changes)."""
+            if self.sensor_key in changed_keys:
+                self.update_state()
+                self.hass.async_add_job(self.async_update_ha_state())
+
+        async_dispatcher_connect(
+            self.hass, self._data.signal_update, async_sensor_update)
+
+
+def heating_state_transition(state_ant, t_imp, t_ret, t_ref,
+                             t_imp_ant1, t_imp_ant2):
+    """Estimate the new heating state from the last temperatures.
+
+    :param state_ant: previous heating state.
+    :param t_imp: supply (`impulsión`) temperature.
+    :param t_ret: return (`retorno`) temperature.
+    :param t_ref: ambient reference temperature.
+    :param t_imp_ant1: previous supply temperature.
+    :param t_imp_ant2: supply temperature before the previous one.
+    :return: new heating state.
+    """
+    if (t_imp_ant1 is None) or (t_imp_ant2 is None):
+        t_imp_ant1 = t_imp_ant2 = state_ant
+
+    if not t_imp or not t_ret or not t_ref:
+        return STATE_HEATING_UNKNOWN
+    elif (t_imp - t_ref <= 7) or ((t_imp + t_ret) < 60 and (t_imp < 30)):
+        return STATE_HEATING_OFF
+    # subida brusca desde Tº ~ ref
+    elif (state_ant == STATE_HEATING_OFF) and \
+            (t_imp > t_ret) and (t_imp - t_imp_ant1 > 1):
+        return STATE_HEATING_COLD_START
+    # bajada brusca en ON
+    elif ((state_ant > STATE_HEATING_OFF)
+          and (state_ant != STATE_HEATING_STOP) and
+              (t_imp - t_imp_ant1 < -.25) and
+              (t_imp - t_imp_ant2 < -.5)):
+        return STATE_HEATING_STOP
+    # subida brusca en ON
+    elif (state_ant == STATE_HEATING_STOP) and \
+            (t_imp - t_imp_ant1 > .25) and (t_imp - t_imp_ant2 > .5):
+        return STATE_HEATING_RESTART
+    elif (state_ant == STATE_HEATING_COLD_START) and \
+            (t_imp - t_imp_ant1 >= 0):
+        return STATE_HEATING_ON
+    elif (state_ant == STATE_HEATING_RESTART) and \
+            (t_imp - t_imp_ant1 >= 0):
+        return STATE_HEATING_ON
+    # Confirmación de OFF (No Parada transitoria)
+    elif (state_ant == STATE_HEATING_STOP) and \
+            (t_imp - t_ref < 25) and (t_imp_ant2 - t_imp > .5):
+        return STATE_HEATING_OFF
+    elif (state_ant == STATE_HEATING_STOP) and (t_imp - t_imp_ant1 <= 2):
+        return STATE_HEATING_STOP
+    elif (state_ant == STATE_HEATING_ON) and (t_imp - t_ref > 7):
+        return state_ant
+    elif state_ant == STATE_HEATING_UNKNOWN:
+        if (t_imp > t_ret) and (t_imp > t_ref + 7):
+            return STATE_HEATING_ON
+        return STATE_HEATING_OFF
+    return state_ant
+
+
+def _naive_local(timestamp):
+    """Return a timestamp as a naive datetime in local time."""
+    if timestamp.tzinfo is not None:
+        return as_local(timestamp).replace(tzinfo=None)
+    return timestamp
+
+
+class HeatingCycles(object):
+    """Heating cycles and on-time per day, from the heating states."""
+
+    def __init__(self, max_days=HEATING_HISTORY_DAYS):
+        """Initialize an empty history."""
+        self.max_days = max_days
+        self.cycles = {}
+        self.on_time = {}
+        self._last_ts = None
+        self._last_state = STATE_HEATING_UNKNOWN
+
+    def add(self, timestamp, state):
+        """Account a new heating state at some timestamp."""
+        timestamp = _naive_local(timestamp)
+        if self._last_ts is not None and timestamp > self._last_ts \
+                and self._last_state in HEATING_ON_STATES:
+            day = self._last_ts.date()
+            self.on_time[day] = self.on_time.get(day, 0) + (
+                timestamp - self._last_ts).total_seconds()
+        if state in HEATING_ON_STATES and self._last_state in (
+                STATE_HEATING_OFF, STATE_HEATING_UNKNOWN):
+            day = timestamp.date()
+            self.cycles[day] = self.cycles.get(day, 0) + 1
+        self._last_ts, self._last_state = timestamp, state
+        for days in (self.cycles, self.on_time):
+            while len(days) > self.max_days:
+                days.pop(min(days))
+
+    @property
+    def attributes(self):
+        """Return the cycles and hours on of each day, as attributes."""
+        return {
+            'cycles_per_day': {day.isoformat(): n
+                               for day, n in sorted(self.cycles.items())},
+            'on_time_per_day': {day.isoformat(): round(secs / 3600, 2)
+                                for day, secs in sorted(self.on_time.items())}
+        }
+
+
+def estimate_heating_states(t_supply, t_return, t_ref,
+                            state=STATE_HEATING_UNKNOWN):
+    """Estimate the heating states of series of temperatures in one pass.
+
+    Same logic as `heating_state_transition`, with all the temperature
+    conditions evaluated at once with NumPy arrays, so only the transitions
+    between states are left for the loop over the samples.
+
+    :param t_supply: array of supply temperatures.
+    :param t_return: array of return temperatures.
+    :param t_ref: array of ambient reference temperatures.
+    :param state: initial heating state.
+    :return: array with the heating state after each sample.
+    """
+    import numpy as np
+
+    t_imp = np.asarray(t_supply, dtype=float)
+    t_ret = np.asarray(t_return, dtype=float)
+    t_ref = np.asarray(t_ref, dtype=float)
+    n_samples = len(t_imp)
+    states = np.empty(n_samples, dtype=int)
+
+    # The first 2 samples (without previous supply temps) are estimated
+    # with the scalar logic:
+    supply_ant = [None, None]
+    for i in range(min(2, n_samples)):
+        state = heating_state_transition(
+            state, t_imp[i], t_ret[i], t_ref[i], supply_ant[-1],
+            supply_ant[-2])
+        supply_ant.append(t_imp[i])
+        states[i] = state
+    if n_samples <= 2:
+        return states
+
+    delta_1 = np.full(n_samples, np.nan)
+    delta_1[1:] = t_imp[1:] - t_imp[:-1]
+    delta_2 = np.full(n_samples, np.nan)
+    delta_2[2:] = t_imp[2:] - t_imp[:-2]
+    with np.errstate(invalid='ignore'):
+        unknown = np.isnan(t_imp) | np.isnan(t_ret) | np.isnan(t_ref) | (
+            t_imp == 0) | (t_ret == 0) | (t_ref == 0)
+        off = (t_imp - t_ref <= 7) | (((t_imp + t_ret) < 60) & (t_imp < 30))
+        cold_start = (t_imp > t_ret) & (delta_1 > 1)
+        hot_stop = (delta_1 < -.25) & (delta_2 < -.5)
+        hot_restart = (delta_1 > .25) & (delta_2 > .5)
+        rising = delta_1 >= 0
+        confirm_off = (t_imp - t_ref < 25) & (delta_2 < -.5)
+        init_on = (t_imp > t_ret) & (t_imp > t_ref + 7)
+
+    # (a STOP or ON state is kept in the remaining cases)
+    conditions = zip(*(cond[2:].tolist() for cond in (
+        unknown, off, cold_start, hot_stop, hot_restart, rising,
+        confirm_off, init_on)))
+    for i, (is_unknown, is_off, is_cold_start, is_hot_stop, is_restart,
+            is_rising, is_confirm_off, is_init_on) in enumerate(conditions, 2):
+        if is_unknown:
+            state = STATE_HEATING_UNKNOWN
+        elif is_off:
+            state = STATE_HEATING_OFF
+        elif state == STATE_HEATING_OFF:
+            if is_cold_start:
+                state = STATE_HEATING_COLD_START
+        elif state == STATE_HEATING_UNKNOWN:
+            state = STATE_HEATING_ON if is_init_on else STATE_HEATING_OFF
+        elif state == STATE_HEATING_STOP:
+            if is_restart:
+                state = STATE_HEATING_RESTART
+            elif is_confirm_off:
+                state = STATE_HEATING_OFF
+        elif is_hot_stop:
+            state = STATE_HEATING_STOP
+        elif state in (STATE_HEATING_COLD_START, STATE_HEATING_RESTART):
+            if is_rising:
+                state = STATE_HEATING_ON
+        states[i] = state
+    return states
+
+
+def replay_heating_states(samples, state=STATE_HEATING_UNKNOWN,
+                          cycles=None):
+    """Run the heating state machine over a sequence of samples.
+
+    :param samples: iterable of (timestamp, t_supply, t_return, t_reference).
+    :param state: initial heating state.
+    :param cycles: `HeatingCycles` object to account the states.
+    :return: last state, last 3 supply temperatures and heating cycles.
+    """
+    cycles = cycles if cycles is not None else HeatingCycles()
+    samples = list(samples)
+    if not samples:
+        return state, deque([None] * 3, 3), cycles
+    timestamps, t_supply, t_return, t_ref = zip(*samples)
+    states = estimate_heating_states(t_supply, t_return, t_ref, state)
+    for timestamp, state in zip(timestamps, states.tolist()):
+        cycles.add(timestamp, state)
+    return state, deque([None] * 3 + list(t_supply[-3:]), 3), cycles
 
 
 class EnerwebHeaterState(Entity):
     """Representation of the state of the heating system measured
     indirectly with enerweb temperature sensors."""
 
-    def __init__(self, data_handler, sensor_supply, sensor_return, sensor_ref):
+    def __init__(self, data_handler, sensor_supply, sensor_return, sensor_ref,
+                 backfill_hours=DEFAULT_BACKFILL_HOURS):
         """Initialize the sensor."""
         self._name = 'Calefacción'
         self._state = STATE_HEATING_UNKNOWN
@@ -250,7 +499,14 @@ class EnerwebHeaterState(Entity):
         self._sensor_return = sensor_return
         self._sensor_reference = sensor_ref
         self._supply_ant = deque([self._sensor_supply.state] * 3, 3)
-        self.async_update()
+        self._sensor_keys = {sensor_supply.sensor_key,
+                             sensor_return.sensor_key, sensor_ref.sensor_key}
+        # (the polling interval follows the supply and return probes)
+        self._data.heater_keys = (sensor_supply.sensor_key,
+                                  sensor_return.sensor_key)
+        self._backfill_hours = backfill_hours
+        self._cycles = HeatingCycles()
+        self.update_state()
 
     @property
     def name(self):
@@ -262,98 +518,127 @@ class EnerwebHeaterState(Entity):
         """Return the state of the sensor."""
         return D_STATES_HEATING[self._state]
 
+    @property
+    def should_poll(self):
+        """Return True if entity has to be polled for state."""
+        return False
+
+    @property
+    def device_state_attributes(self):
+        """Return the heating cycles and on-time of the last days."""
+        return self._cycles.attributes
+
+    @asyncio.coroutine
+    def async_added_to_hass(self):
+        """Register update dispatcher and backfill the heating history."""
+        @callback
+        def async_heater_update(changed_keys):
+            """Update callback (when any of the 3 sensors changes)."""
+            if self._sensor_keys.intersection(changed_keys):
+                # (the sensors may not have processed the signal yet)
+                for sensor in (self._sensor_supply, self._sensor_return,
+                               self._sensor_reference):
+                    sensor.update_state()
+                self.update_state()
+                self.hass.async_add_job(self.async_update_ha_state())
+
+        async_dispatcher_connect(
+            self.hass, self._data.signal_update, async_heater_update)
+        if self._backfill_hours:
+            self.hass.async_add_job(self.async_backfill())
+
     @asyncio.coroutine
-    def async_update(self):
-        """Get the latest data and updates the states."""
-        # self._data.async_update()
+    def async_backfill(self):
+        """Restore the heating state and cycles with the last hours data."""
+        sensors = (self._sensor_supply, self._sensor_return,
+                   self._sensor_reference)
+        samples = yield from self._data.async_query_history(
+            [s.sensor_key for s in sensors], self._backfill_hours,
+            [s.round_result for s in sensors])
+        if not samples:
+            return
+        state, supply_ant, cycles = yield from self.hass.async_add_job(
+            replay_heating_states, samples)
+        _LOGGER.info('Heater state restored with {} samples of the last {} h:'
+                     ' {} (was {}), {}'.format(
+                         len(samples), self._backfill_hours,
+                         D_STATES_HEATING[state], self.state,
+                         cycles.attributes))
+        self._state = state
+        self._supply_ant = supply_ant
+        self._cycles = cycles
+        self.hass.async_add_job(self.async_update_ha_state())
+
+    def update_state(self):
+        """Estimate the heating state with the last temperatures."""
         if self._data.last_sensor_data is not None:
             t_imp = self._sensor_supply.state
             t_ret = self._sensor_return.state
             t_ref = self._sensor_reference.state
             state_ant = self._state
             t_imp_ant1, t_imp_ant2 = self._supply_ant[-1], self._supply_ant[-2]
-            if (t_imp_ant1 is None) or(t_imp_ant2 is None):
-                t_imp_ant1 = t_imp_ant2 = state_ant
             _LOGGER.debug('{}- UPDATE HEATER STATE: st_ant={}; IMP={}, RET={},'
                           ' REF={}; IMP1={}, IMP2={}'
                           .format(now(), state_ant, t_imp, t_ret,
                                   t_ref, t_imp_ant1, t_imp_ant2))
-
-            if not t_imp or not t_ret or not t_ref:
-                new_state = STATE_HEATING_UNKNOWN
-            elif (t_imp - t_ref <= 7) or \
-                    ((t_imp + t_ret) < 60 and (t_imp < 30)):
-                new_state = STATE_HEATING_OFF
-            # subida brusca desde Tº ~ ref
-            elif (state_ant == STATE_HEATING_OFF) and \
-                    (t_imp > t_ret) and (t_imp - t_imp_ant1 > 1):
-                _LOGGER.debug('COLD START')
-                new_state = STATE_HEATING_COLD_START
-            # bajada brusca en ON
-            elif ((state_ant > STATE_HEATING_OFF)
-                  and (state_ant != STATE_HEATING_STOP) and
-                      (t_imp - t_imp_ant1 < -.25) and
-                      (t_imp - t_imp_ant2 < -.5)):
-                _LOGGER.debug('HOT STOP')
-                new_state = STATE_HEATING_STOP
-            # subida brusca en ON
-            elif (state_ant == STATE_HEATING_STOP) and \
-                    (t_imp - t_imp_ant1 > .25) and (t_imp - t_imp_ant2 > .5):
-                _LOGGER.debug('HOT RE-START')
-                new_state = STATE_HEATING_RESTART
-            elif (state_ant == STATE_HEATING_COLD_START) and \
-                    (t_imp - t_imp_ant1 >= 0):
-                _LOGGER.debug('ON AFTER COLD-START')
-                new_state = STATE_HEATING_ON
-            elif (state_ant == STATE_HEATING_RESTART) and \
-                    (t_imp - t_imp_ant1 >= 0):
-                _LOGGER.debug('ON AFTER RE-START')
-                new_state = STATE_HEATING_ON
-            # Confirmación de OFF (No Parada transitoria)
-            elif (state_ant == STATE_HEATING_STOP) and \
-                    (t_imp - t_ref < 25) and (t_imp_ant2 - t_imp > .5):
-                new_state = STATE_HEATING_OFF
-            elif (state_ant == STATE_HEATING_STOP) and \
-                    (t_imp - t_imp_ant1 <= 2):
-                new_state = STATE_HEATING_STOP
-            elif (state_ant == STATE_HEATING_ON) and (t_imp - t_ref > 7):
-                new_state = state_ant
-            elif state_ant == STATE_HEATING_UNKNOWN:
-                if (t_imp > t_ret) and (t_imp > t_ref + 7):
-                    _LOGGER.info('INIT HASS WITH HEATING ON')
-                    new_state = STATE_HEATING_ON
-                else:
-                    _LOGGER.info('INIT HASS WITH HEATING OFF')
-                    new_state = STATE_HEATING_OFF
-            else:
-                new_state = state_ant
+            new_state = heating_state_transition(
+                state_ant, t_imp, t_ret, t_ref, t_imp_ant1, t_imp_ant2)
+            if new_state != state_ant:
+                _LOGGER.debug('HEATER STATE: {} -> {}'.format(
+                    D_STATES_HEATING[state_ant], D_STATES_HEATING[new_state]))
             self._state = new_state
             self._supply_ant.append(t_imp)
+            self._cycles.add(now(), new_state)
+            self._data.heater_transient = new_state in (
+                STATE_HEATING_COLD_START, STATE_HEATING_RESTART)
 
 
 class EnerwebData(object):
     """Get the latest data for the enerweb platform."""
 
     def __init__(self, hass, enerweb_host, devices, timezone,
-                 timeout=DEFAULT_TIMEOUT, mysql_user=None, mysql_pass=None):
-        """Initialize the data handler object."""
+                 timeout=DEFAULT_TIMEOUT, mysql_user=None, mysql_pass=None,
+                 backend=BACKEND_AUTO, min_interval=DEFAULT_MIN_INTERVAL,
+                 max_interval=DEFAULT_MAX_INTERVAL, db_url=None):
+        """Initialize the data handler object.
+
+        `db_url` overrides the MySQL DB URL (as a SQLAlchemy URI), e.g.,
+        to use a local SQLite DB with the same tables.
+        """
         self.hass = hass
         self._host = enerweb_host
         self._site = None
         self._timezone = timezone
         self._timeout = timeout
-        # self._scan_interval = timedelta(seconds=scan_interval)
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self.scan_interval = min(max(SCAN_INTERVAL.total_seconds(),
+                                     min_interval), max_interval)
+        self.heater_transient = False
+        self.heater_keys = ()
+        self._heater_readings = {}
+        self._change_rate = None
+        self._unsub_update = None
+        self._stopped = False
         self._mysql_u = mysql_user
         self._mysql_p = mysql_pass
-        # self._mysql_session = None
-        self.path_database = URL_MASK_ENERWEB_GET_DATA_MYSQL.format(
+        self.path_database = db_url or URL_MASK_ENERWEB_GET_DATA_MYSQL.format(
             self._mysql_u, self._mysql_p, self._host)
+        self._url_api = URL_MASK_ENERWEB_GET_DATA.format(self._host)
+        self._backend = backend
+        self.use_mysql = backend != BACKEND_HTTP
+        self._mysql_retry_at = 0
         self._engine = None
+        self.hass.bus.listen_once(EVENT_HOMEASSISTANT_STOP, self._async_stop)
 
         self._raw_data = None
         self._last_valid_request = None
         self._last_request_was_invalid = False
         self.last_sensor_data = None
+        self.sensor_values = {}
+        self.signal_update = SIGNAL_UPDATE_ENERWEB.format(slugify(enerweb_host))
+        self.sensor_id_index = {}
+        self.updated_tables = set()
         self._updating = False
 
         d_monitored_variables = {}
@@ -364,88 +649,443 @@ class EnerwebData(object):
                 d_monitored_variables[sensor_type] = [sensor_mag]
         self._monitored_variables_mysql = d_monitored_variables
 
-        async_track_point_in_utc_time(self.hass, self.async_update,
-                                      now() + timedelta(seconds=3))
-        async_track_time_interval(self.hass, self.async_update, SCAN_INTERVAL)
+        # Queries and row extractors of each table (from its discovered
+        # columns), and the highest `id` seen in each one:
+        self._columns_tables = None
+        self._queries = {}
+        self._extractors = {}
+        self._last_ids = {s_type: -1
+                          for s_type in self._monitored_variables_mysql}
+
+        self._unsub_update = async_track_point_in_utc_time(
+            self.hass, self.async_update, now() + timedelta(seconds=3))
+
+    def _get_engine(self):
+        """Return the SQL engine, with its bounded pool of connections."""
+        from sqlalchemy import create_engine
+        from sqlalchemy.pool import QueuePool
 
-    @asyncio.coroutine
-    def async_get_session(self):
         if self._engine is None:
-            self._engine = yield from self.hass.async_add_job(
-            partial(create_engine, self.path_database, echo=False))
+            if self.path_database.startswith('sqlite'):
+                connect_args = {'timeout': self._timeout,
+                                'check_same_thread': False}
+            else:
+                connect_args = {'connect_timeout': self._timeout}
+            self._engine = create_engine(
+                self.path_database, echo=False, poolclass=QueuePool,
+                pool_size=len(self._monitored_variables_mysql),
+                max_overflow=POOL_MAX_OVERFLOW,
+                pool_timeout=self._timeout, pool_recycle=POOL_RECYCLE_SEC,
+                pool_pre_ping=True, connect_args=connect_args)
             _LOGGER.debug('Created engine: {}'.format(self._engine))
-        session = yield from self.hass.async_add_job(
-            partial(sessionmaker, bind=self._engine))
-        # return self._engine.connect()
-        return session()
+        return self._engine
+
+    # noinspection PyUnusedLocal
+    @callback
+    def _async_stop(self, event):
+        """Stop the polling and close the SQL connections."""
+        self._stopped = True
+        if self._unsub_update is not None:
+            self._unsub_update()
+            self._unsub_update = None
+        self.hass.async_add_job(self.close)
+
+    @callback
+    def _async_schedule_update(self):
+        """Adapt the polling interval and schedule the next update."""
+        if self._stopped:
+            return
+        # (the interval is kept while there are no new heating readings)
+        rate = self._change_rate
+        if self.heater_transient or (
+                rate is not None and rate >= FAST_CHANGE_RATE):
+            self.scan_interval = self._min_interval
+        elif rate is not None and rate < FLAT_CHANGE_RATE:
+            self.scan_interval = min(self.scan_interval * INTERVAL_BACKOFF,
+                                     self._max_interval)
+        _LOGGER.debug('Next update in {:.0f} s (heating change rate: {} '
+                      '°C/min, heater transient: {})'
+                      .format(self.scan_interval, rate,
+                              self.heater_transient))
+        self._unsub_update = async_track_point_in_utc_time(
+            self.hass, self.async_update,
+            now() + timedelta(seconds=self.scan_interval))
 
     # noinspection PyUnusedLocal
+    def close(self, *args):
+        """Close the pooled SQL connections."""
+        if self._engine is not None:
+            self._engine.dispose()
+            _LOGGER.debug('Disposed engine: {}'.format(self._engine))
+            self._engine = None
+
+    def _set_json_data(self, json_data):
+        """Set the data from the enerweb API, indexing the id-keyed rows.
+
+        The rows of the `{sensor_type}_data` lists of sensors identified by
+        id (ds18b20) are indexed by each of their values, so each sensor
+        gets its row (the first one containing its id) with a dict lookup.
+        """
+        sensor_id_index = {}
+        for s_type in self._monitored_variables_mysql:
+            if not s_type.startswith('ds18b20'):
+                continue
+            for row in json_data.get(s_type + '_data') or []:
+                for value in row.values():
+                    try:
+                        sensor_id_index.setdefault(value, row)
+                    except TypeError:  # (not hashable)
+                        pass
+        self.sensor_id_index = sensor_id_index
+        self.last_sensor_data = json_data
+
+    def _discover_columns(self):
+        """Get the column names of each monitored table."""
+        from sqlalchemy import inspect, text
+
+        columns_tables = {}
+        if self._engine.dialect.name != 'mysql':  # (no INFORMATION_SCHEMA)
+            inspector = inspect(self._engine)
+            for s_type in self._monitored_variables_mysql:
+                table = JSON_MYSQL_TRANSLATION[s_type][0]
+                columns_tables[s_type] = {
+                    col['name']: i
+                    for i, col in enumerate(inspector.get_columns(table))}
+            return columns_tables
+
+        with self._engine.connect() as conn:
+            for s_type in self._monitored_variables_mysql:
+                table = JSON_MYSQL_TRANSLATION[s_type][0]
+                rows = conn.execute(text(SQLMASK_SELECT_TABLE_COLUMN_NAMES),
+                                    {'table': table})
+                columns_tables[s_type] = {
+                    row[0]: i for i, row in enumerate(rows)}
+        return columns_tables
+
+    def _make_queries(self, columns_tables):
+        """Make the queries and row extractors with the existing columns.
+
+        Each query selects `id, ts` and the columns of the monitored
+        magnitudes, and each extractor gets the magnitude values of a row
+        (or the `(sensor_id, temperature)` pair for the ds18b20 table).
+        """
+        from sqlalchemy import text
+
+        self._columns_tables = columns_tables
+        for s_type, s_mags in self._monitored_variables_mysql.items():
+            table, cols_table = JSON_MYSQL_TRANSLATION[s_type]
+            cols_tsql = columns_tables[s_type]
+            if table == 'measureds18b20':  # multiple rows (1x sensor_id)
+                mags_columns = [('sensor_id', cols_table['temp']),
+                                ('temperature', 'temperature')]
+                required = [KEY_ID, KEY_TIMESTAMP] + [
+                    col for _, col in mags_columns]
+                n_last = len(s_mags)
+            else:
+                mags_columns = [(mag, cols_table[mag]) for mag in s_mags]
+                required = [KEY_ID, KEY_TIMESTAMP]
+                n_last = 1
+            missing = [col for col in required + [c for _, c in mags_columns]
+                       if col not in cols_tsql]
+            if missing:
+                _LOGGER.error('Columns {} not found in table {} (columns: {})'
+                              .format(missing, table, list(cols_tsql)))
+                mags_columns = [(mag, col) for mag, col in mags_columns
+                                if col in cols_tsql]
+                if set(missing).intersection(required) or not mags_columns:
+                    continue
+            columns = [KEY_ID, KEY_TIMESTAMP] + [c for _, c in mags_columns]
+            self._queries[s_type] = text(
+                SQLMASK_SELECT_TABLE_LAST_VALUES.format(
+                    ', '.join(columns), table, n_last))
+            # Values are after `id, ts` in the selected rows
+            # (and a one-item itemgetter would not return a tuple):
+            if len(mags_columns) > 1:
+                extractor = itemgetter(*range(2, len(columns)))
+            else:
+                extractor = itemgetter(slice(2, 3))
+            self._extractors[s_type] = ([mag for mag, _ in mags_columns],
+                                        extractor)
+
+    def _query_last_values(self, s_type):
+        """Get the new rows of one table with a pooled connection."""
+        with self._engine.connect() as conn:
+            return conn.execute(self._queries[s_type],
+                                {'last_id': self._last_ids[s_type]}).fetchall()
+
+    def _query_history(self, sensor_keys, since, rounds):
+        """Get the samples of some sensors since some time in one query.
+
+        The rows of all sensors are read with one `UNION ALL` query sorted
+        by time. As in the live updates (one per poll), there is one sample
+        per reading of the first sensor (the heating supply), with the last
+        values of all the sensors before its next reading (the readings with
+        the same `ts` are sorted after it).
+        """
+        from sqlalchemy import text
+
+        queries, params = [], {'since': since}
+        for i, (s_type, s_mag) in enumerate(sensor_keys):
+            table, cols_table = JSON_MYSQL_TRANSLATION[s_type]
+            if table == 'measureds18b20':  # (1x sensor_id)
+                queries.append(SQLMASK_SELECT_HISTORY.format(
+                    i, 'temperature', table)
+                    + ' AND {} = :id_{}'.format(cols_table['temp'], i))
+                params['id_{}'.format(i)] = s_mag
+            else:
+                queries.append(SQLMASK_SELECT_HISTORY.format(
+                    i, cols_table[s_mag], table))
+        query = text(' UNION ALL '.join(queries) + ' ORDER BY ts, idx')
+        with self._engine.connect() as conn:
+            rows = conn.execute(query, params).fetchall()
+
+        samples = []
+        last_values = [None] * len(sensor_keys)
+        sample_ts = None
+        for ts, idx, value in rows:
+            if value is not None and rounds[idx] is not None:
+                value = round(value, rounds[idx])
+            if idx == 0:  # (new reading, the previous sample is complete)
+                if sample_ts is not None and None not in last_values:
+                    samples.append((sample_ts, *last_values))
+                sample_ts = ts
+            last_values[idx] = value
+        if sample_ts is not None and None not in last_values:
+            samples.append((sample_ts, *last_values))
+        _LOGGER.debug('History of {}: {} rows -> {} samples'
+                      .format(sensor_keys, len(rows), len(samples)))
+        return samples
+
     @asyncio.coroutine
-    def async_update(self, *args):
+    def async_query_history(self, sensor_keys, hours, rounds=None):
+        """Get the (ts, value_1, ..., value_n) samples of some sensors.
+
+        Only with the MySQL backend (None is returned with the API one).
+        """
+        from sqlalchemy.exc import SQLAlchemyError
+
+        if not self.use_mysql:
+            return None
+        rounds = rounds or [None] * len(sensor_keys)
+        since = _naive_local(now()) - timedelta(hours=hours)
+        self._get_engine()
+        try:
+            return (yield from self.hass.async_add_job(
+                self._query_history, sensor_keys, since, rounds))
+        except (SQLAlchemyError, OSError) as e:
+            _LOGGER.warning('Error getting the history of {}: {} [{}]'
+                            .format(sensor_keys, e, e.__class__))
+        return None
+
+    def _sensor_value(self, s_type, s_mag):
+        """Return the (timestamp, value) of a sensor in the last data."""
+        try:
+            if self.use_mysql:
+                sensor_data = self.last_sensor_data[s_type]
+                return sensor_data[KEY_TIMESTAMP], sensor_data[s_mag]
+            sensor_data = self.last_sensor_data[s_type + '_data']
+            if not sensor_data:
+                return None
+            if s_type.startswith('ds18b20'):
+                data_entity = self.sensor_id_index.get(s_mag)
+                if data_entity is None:
+                    _LOGGER.warning('No data_entity in update sensor by'
+                                    ' id. Data:{}'.format(sensor_data))
+                    return None
+                return data_entity[KEY_TIMESTAMP], data_entity['temp']
+            data_entity = sensor_data[0]
+            return data_entity[KEY_TIMESTAMP], data_entity[s_mag]
+        except KeyError as e:
+            _LOGGER.warning('KeyError: {}. No UPDATE OF {}-{}'
+                            .format(e, s_type, s_mag))
+            return None
+
+    def _dispatch_changes(self):
+        """Send the signal with the sensor keys whose value changed."""
+        if self.last_sensor_data is None:
+            return
+        changed_keys = set()
+        for s_type, s_mags in self._monitored_variables_mysql.items():
+            for s_mag in s_mags:
+                ts_value = self._sensor_value(s_type, s_mag)
+                if ts_value is None:
+                    continue
+                old = self.sensor_values.get((s_type, s_mag))
+                if old is None or old[1] != ts_value[1]:
+                    changed_keys.add((s_type, s_mag))
+                if (s_type, s_mag) in self.heater_keys:
+                    self._update_change_rate((s_type, s_mag), ts_value)
+                self.sensor_values[(s_type, s_mag)] = ts_value
+        if changed_keys:
+            _LOGGER.debug('Changed sensors: {}'.format(changed_keys))
+            async_dispatcher_send(self.hass, self.signal_update, changed_keys)
+
+    def _update_change_rate(self, sensor_key, ts_value):
+        """Update the max rate of change (°C/min) of the heating probes.
+
+        The rate of a new reading is taken over the time between its row
+        and the previous one (or between the polls that got them, with the
+        text timestamps of the API).
+        """
+        ts, value = ts_value
+        received = time()
+        last = self._heater_readings.get(sensor_key)
+        if last is not None and last[0] == ts:
+            return
+        self._heater_readings[sensor_key] = ts, value, received
+        if last is None:
+            return
+        try:
+            elapsed = (ts - last[0]).total_seconds()
+        except (TypeError, AttributeError):
+            elapsed = received - last[2]
+        try:
+            rate = 60 * abs(value - last[1]) / max(elapsed, 1)
+        except TypeError:  # (not numeric)
+            return
+        self._change_rate = max(self._change_rate or 0, rate)
+
+    def _log_valid_data(self, backend, last_data):
+        """Log a valid update (as info after an invalid one)."""
+        self._last_valid_request = now(self._timezone)
+        if self._last_request_was_invalid:
+            f_log = _LOGGER.info
+        else:
+            f_log = _LOGGER.debug
+        f_log('{}_UPDATE last_data={} [{}]'
+              .format(backend, last_data, self._last_valid_request))
+        self._last_request_was_invalid = False
+
+    def _log_invalid_data(self, msg):
+        """Log an error only for the first one of consecutive errors."""
+        if not self._last_request_was_invalid:
+            _LOGGER.error(msg)
+        self._last_request_was_invalid = True
+
+    @asyncio.coroutine
+    def _async_update_mysql(self):
         """Update enerweb sensor data w/ mysql remote access."""
+        from sqlalchemy.exc import SQLAlchemyError
+
+        try:
+            # MYSQL QUERIES (in parallel, with pooled connections):
+            tic = time()
+            self._get_engine()  # (no connection, before the threads)
+            if self._columns_tables is None:
+                columns_tables = yield from self.hass.async_add_job(
+                    self._discover_columns)
+                self._make_queries(columns_tables)
+            s_types = list(self._queries)
+            last_values_tables = yield from asyncio.gather(
+                *[self.hass.async_add_job(self._query_last_values, s_type)
+                  for s_type in s_types], loop=self.hass.loop)
+            last_data = dict(self.last_sensor_data or {})
+            updated_tables = set()
+            for s_type, last_values in zip(s_types, last_values_tables):
+                if not last_values:  # no new rows in this table
+                    continue
+                mags, extractor = self._extractors[s_type]
+                table = JSON_MYSQL_TRANSLATION[s_type][0]
+                _LOGGER.debug('NEW VALUES ({}-{}) => {}'
+                              .format(s_type, table, last_values))
+                self._last_ids[s_type] = last_values[0][0]
+                updated_tables.add(s_type)
+                if table != 'measureds18b20':  # id, ts, mag_1, mag_2...
+                    row = last_values[0]
+                    last_data[s_type] = {KEY_TIMESTAMP: row[1]}
+                    last_data[s_type].update(zip(mags, extractor(row)))
+                else:  # ds18b20 rows: id, ts, sensor_id, temp
+                    # (merged by sensor id, from oldest to newest row)
+                    table_data = dict(last_data.get(s_type, {}))
+                    table_data[KEY_TIMESTAMP] = last_values[0][1]
+                    table_data.update(
+                        extractor(row) for row in reversed(last_values))
+                    last_data[s_type] = table_data
+            _LOGGER.debug('SQL queries of {} tables in {:.3f} s '
+                          '({} updated)'.format(len(s_types), time() - tic,
+                                                len(updated_tables)))
+            self.updated_tables = updated_tables
+            if updated_tables:
+                self.last_sensor_data = last_data
+            self._log_valid_data('SQL', last_data)
+            return True
+        except (SQLAlchemyError, OSError) as e:
+            self._log_invalid_data('{}: {}'.format(e.__class__, e))
+        except Exception as e:
+            self._log_invalid_data('UNKNOWN ERROR {} [{}] trying to update '
+                                   'from SQL DB'.format(e, e.__class__))
+        return False
+
+    @asyncio.coroutine
+    def _async_update_http(self):
+        """Update enerweb sensor data w/ the enerweb API."""
+        import aiohttp
+        import async_timeout
+
+        try:
+            tic = time()
+            websession = async_get_clientsession(self.hass)
+            with async_timeout.timeout(self._timeout, loop=self.hass.loop):
+                response = yield from websession.get(self._url_api)
+                response.raise_for_status()
+                json_data = yield from response.json(content_type=None)
+            _LOGGER.debug('HTTP request in {:.3f} s'.format(time() - tic))
+            last_data = self.last_sensor_data or {}
+            self.updated_tables = {
+                s_type for s_type in self._monitored_variables_mysql
+                if json_data.get(s_type + '_data')
+                != last_data.get(s_type + '_data')}
+            if self.updated_tables:
+                self._set_json_data(json_data)
+            self._log_valid_data('HTTP', json_data)
+            return True
+        except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+            self._log_invalid_data('{}: {} requesting {}'
+                                   .format(e.__class__, e, self._url_api))
+        except (ValueError, AttributeError) as e:
+            self._log_invalid_data('Bad enerweb API data: {} [{}]'
+                                   .format(e, e.__class__))
+        return False
+
+    def _fallback_to_http(self):
+        """Use the enerweb API while the MySQL DB is unreachable."""
+        if self.use_mysql:
+            _LOGGER.warning('MySQL DB is unreachable, using the enerweb API'
+                            ' (retrying MySQL each {} s)'
+                            .format(MYSQL_RETRY_SEC))
+        self.use_mysql = False
+        self._mysql_retry_at = time() + MYSQL_RETRY_SEC
+        self._last_ids = {s_type: -1 for s_type in self._last_ids}
+        self.close()
+
+    # noinspection PyUnusedLocal
+    @asyncio.coroutine
+    def async_update(self, *args):
+        """Update enerweb sensor data with the selected backend."""
         if self._updating:
             _LOGGER.debug('no async_update --> is updating')
-        else:
-            self._updating = True
-            try:
-                # MYSQL Session:
-                s = yield from self.async_get_session()
-                # MYSQL QUERIES:
-                last_data = {}
-                for s_type, s_mags in self._monitored_variables_mysql.items():
-                    table, cols_table = JSON_MYSQL_TRANSLATION[s_type]
-                    cols_tsql = SQL_COLUMNS_TABLES[s_type]
-                    onerow_table = table != 'measureds18b20'
-                    n_last = 1 if onerow_table else len(s_mags)
-                    task = yield from self.hass.async_add_job(
-                        s.execute,
-                        SQLMASK_SELECT_TABLE_LAST_VALUES.format(table, n_last))
-                    last_values = yield from self.hass.async_add_job(
-                        task.fetchall)
-                    _LOGGER.debug('LAST VALUES ({}-{}) => {}'
-                                  .format(s_type, table, last_values))
-                    if onerow_table and last_values:
-                        ts = last_values[0][cols_tsql.index(KEY_TIMESTAMP)]
-                        last_data[s_type] = {KEY_TIMESTAMP: ts}
-                        for mag in s_mags:
-                            idx = cols_tsql.index(cols_table[mag])
-                            last_data[s_type].update({mag: last_values[0][idx]})
-                    elif last_values:  # ds18b20 multiple rows (1x sensor_id)
-                        ts = last_values[-1][cols_tsql.index(KEY_TIMESTAMP)]
-                        last_data[s_type] = {KEY_TIMESTAMP: ts}
-                        idx_s_ids = cols_tsql.index(cols_table['temp'])
-                        idx_values = cols_tsql.index('temperature')
-                        for row in last_values:
-                            last_data[s_type].update(
-                                {row[idx_s_ids]: row[idx_values]})
-                if last_data:
-                    self.last_sensor_data = last_data
-                    self._last_valid_request = now(self._timezone)
-                    if self._last_request_was_invalid:
-                        f_log = _LOGGER.info
-                    else:
-                        f_log = _LOGGER.debug
-                    f_log('SQL_UPDATE last_data={} [{}]'
-                          .format(last_data, self._last_valid_request))
-                    self._last_request_was_invalid = False
-                    # s.flush()
-                else:
-                    _LOGGER.warning('SQL_UPDATE NO LAST_DATA! => session={}'
-                                    .format(s))
-                    self._last_request_was_invalid = True
-                    # self._mysql_session = None
-            except (OperationalError, TimeoutError, InternalError,
-                    OSError, SQLAlchemyError) as e:
-                if not self._last_request_was_invalid:
-                    _LOGGER.error('{}: {}'.format(e.__class__, e))
-                # self._mysql_session = None
-                self._last_request_was_invalid = True
-                self._engine = None
-            except Exception as e:
-                if not self._last_request_was_invalid:
-                    _LOGGER.error('UNKNOWN ERROR {} [{}] trying to update '
-                                  'from SQL DB'.format(e, e.__class__))
-                # self._mysql_session = None
-                self._last_request_was_invalid = True
-                self._engine = None
+            return
+        self._updating = True
+        self.updated_tables = set()
+        self._change_rate = None
+        try:
+            if self._backend == BACKEND_MYSQL:
+                yield from self._async_update_mysql()
+            elif self._backend == BACKEND_HTTP:
+                yield from self._async_update_http()
+            elif self.use_mysql or time() > self._mysql_retry_at:
+                ok = yield from self._async_update_mysql()
+                if ok and not self.use_mysql:
+                    _LOGGER.info('MySQL DB is reachable again, using it')
+                    self.use_mysql = True
+                elif not ok:
+                    self._fallback_to_http()
+                    yield from self._async_update_http()
+            else:
+                yield from self._async_update_http()
+            if self.updated_tables:
+                self._dispatch_changes()
+        finally:
             self._updating = False
+            # (after the dispatched entity updates, with the heater state)
+            self.hass.loop.call_soon(self._async_schedule_update)
@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the enerweb data handler with a local SQLite stand-in DB.
+
+Builds a SQLite DB with the `measuredht22`, `measureds18b20` and
+`hostmeasure` tables of the enerweb data logger, fills it with synthetic rows
+(one sample every `--step` seconds, with daily cycles and heating cycles in
+the supply & return pipes), and drives `EnerwebData` against it, measuring
+the latency, the transferred rows and the allocations (tracemalloc) of:
+  - cold: first update (schema discovery + last rows of each table).
+  - idle: updates without new rows (index-only queries).
+  - new_rows: updates after inserting a new sample in each table.
+  - history: heater backfill query of the last `--hours` and its replay.
+
+The batch heating state estimator is also checked against the live
+(sample by sample) state machine over the backfill samples.
+
+Run it from the HA config directory (in the HA virtualenv) with:
+```
+    python -m custom_components.sensor.enerweb_benchmark --rows 1000000
+```
+"""
+import argparse
+import asyncio
+import datetime as dt
+import math
+import os
+import random
+import sqlite3
+import tempfile
+import tracemalloc
+from bisect import bisect_left
+from collections import deque
+from time import perf_counter
+
+from homeassistant.core import HomeAssistant
+
+from .enerweb import (
+    BACKEND_MYSQL, STATE_HEATING_UNKNOWN, EnerwebData,
+    estimate_heating_states, heating_state_transition, replay_heating_states)
+
+STAGES = ['cold', 'idle', 'new_rows', 'history']
+SQL_SCHEMAS = [
+    'CREATE TABLE measuredht22 (id INTEGER PRIMARY KEY, ts DATETIME, '
+    'temperature REAL, humidity REAL, exec_id INTEGER)',
+    'CREATE TABLE measureds18b20 (id INTEGER PRIMARY KEY, ts DATETIME, '
+    'temperature REAL, sensor_id VARCHAR(20))',
+    'CREATE TABLE hostmeasure (id INTEGER PRIMARY KEY, ts DATETIME, '
+    'rpi_temp_cpu REAL, sensehat INTEGER, sense_temp REAL, sense_pres REAL, '
+    'sense_hr REAL, sense_tempp REAL, exec_id INTEGER)',
+    'CREATE INDEX ix_measuredht22_ts ON measuredht22 (ts)',
+    'CREATE INDEX ix_measureds18b20_ts ON measureds18b20 (ts)',
+    'CREATE INDEX ix_hostmeasure_ts ON hostmeasure (ts)']
+SENSOR_IDS = {'supply': '031504c1eeff', 'return': '0000071d270e',
+              'dhw': '03150492d7ff'}
+DEVICES = [('ds18b20', SENSOR_IDS['return'], 'Retorno calefacción'),
+           ('ds18b20', SENSOR_IDS['supply'], 'Impulsión calefacción'),
+           ('ds18b20', SENSOR_IDS['dhw'], 'ACS'),
+           ('dht22', 'temp', 'Temperatura'),
+           ('dht22', 'hum', 'Humedad'),
+           ('rpi2', 'rpit', 'RPI CPU temp'),
+           ('rpi2', 'pres', 'Presión')]
+
+
+def synthetic_samples(n_samples, step, start):
+    """Generate the rows of all the tables for `n_samples` timestamps."""
+    for i in range(n_samples):
+        ts = start + dt.timedelta(seconds=i * step)
+        hour = ts.hour + ts.minute / 60
+        t_amb = 20 + 2 * math.sin(2 * math.pi * (hour - 9) / 24)
+        heating = (6 <= hour < 9) or (18 <= hour < 23)
+        t_supply = 65 if heating else t_amb + 5
+        t_supply += random.gauss(0, .3)
+        t_return = t_supply - (8 if heating else 1) + random.gauss(0, .3)
+        yield ((ts, round(t_amb + random.gauss(0, .1), 1),
+                round(50 + random.gauss(0, 2), 1), i),
+               [(ts, round(t_supply, 2), SENSOR_IDS['supply']),
+                (ts, round(t_return, 2), SENSOR_IDS['return']),
+                (ts, round(45 + random.gauss(0, 1), 2), SENSOR_IDS['dhw'])],
+               (ts, round(50 + random.gauss(0, 2), 1), 1, t_amb, 1013.,
+                50., t_amb, i))
+
+
+def insert_samples(conn, samples):
+    """Insert the rows of some samples in all the tables."""
+    rows_dht, rows_ds, rows_host = [], [], []
+    for row_dht, rows_ds_i, row_host in samples:
+        rows_dht.append(row_dht)
+        rows_ds += rows_ds_i
+        rows_host.append(row_host)
+    conn.executemany('INSERT INTO measuredht22 (ts, temperature, humidity, '
+                     'exec_id) VALUES (?, ?, ?, ?)', rows_dht)
+    conn.executemany('INSERT INTO measureds18b20 (ts, temperature, '
+                     'sensor_id) VALUES (?, ?, ?)', rows_ds)
+    conn.executemany('INSERT INTO hostmeasure (ts, rpi_temp_cpu, sensehat, '
+                     'sense_temp, sense_pres, sense_hr, sense_tempp, '
+                     'exec_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows_host)
+    conn.commit()
+
+
+def make_database(path, n_rows, step, chunk=50000):
+    """Make the SQLite DB with ~`n_rows` rows (the ds18b20 table has 3x)."""
+    n_samples = max(1, n_rows // 5)
+    start = dt.datetime.now() - dt.timedelta(seconds=n_samples * step)
+    conn = sqlite3.connect(path)
+    for schema in SQL_SCHEMAS:
+        conn.execute(schema)
+    samples = synthetic_samples(n_samples, step, start)
+    while True:
+        batch = [s for _, s in zip(range(chunk), samples)]
+        if not batch:
+            break
+        insert_samples(conn, batch)
+    return conn, start + dt.timedelta(seconds=n_samples * step)
+
+
+def check_heating_estimator(samples):
+    """Compare the batch estimator with the live state machine.
+
+    :return: number of samples, mismatches and time of each (s).
+    """
+    _, t_supply, t_return, t_ref = zip(*samples)
+    tic = perf_counter()
+    batch_states = estimate_heating_states(
+        t_supply, t_return, t_ref).tolist()
+    time_batch = perf_counter() - tic
+
+    tic = perf_counter()
+    state, supply_ant, live_states = STATE_HEATING_UNKNOWN, deque(
+        [None] * 3, 3), []
+    for _, t_imp, t_ret, t_ref_i in samples:
+        state = heating_state_transition(state, t_imp, t_ret, t_ref_i,
+                                         supply_ant[-1], supply_ant[-2])
+        supply_ant.append(t_imp)
+        live_states.append(state)
+    time_live = perf_counter() - tic
+    mismatches = sum(s_b != s_l for s_b, s_l in zip(batch_states, live_states))
+    return len(samples), mismatches, time_batch, time_live
+
+
+def per_poll_samples(conn, since):
+    """Get the heater samples as read by one poll after each supply reading.
+
+    Independent of the history query: each series is read on its own and
+    each poll takes the last values before the next supply reading.
+    """
+    series = [conn.execute(sql + ' AND ts >= ? ORDER BY ts', params + (since,))
+              .fetchall() for sql, params in [
+                  ('SELECT ts, temperature FROM measureds18b20 '
+                   'WHERE sensor_id = ?', (SENSOR_IDS['supply'],)),
+                  ('SELECT ts, temperature FROM measureds18b20 '
+                   'WHERE sensor_id = ?', (SENSOR_IDS['return'],)),
+                  ('SELECT ts, temperature FROM measuredht22 WHERE 1', ())]]
+    supply, others = series[0], series[1:]
+    others_ts = [[ts for ts, _ in rows] for rows in others]
+    samples = []
+    for i, (ts, t_supply) in enumerate(supply):
+        values = [round(t_supply, 1)]
+        for rows, rows_ts in zip(others, others_ts):
+            if i + 1 < len(supply):
+                j = bisect_left(rows_ts, supply[i + 1][0])
+            else:
+                j = len(rows_ts)
+            if not j:
+                break
+            values.append(round(rows[j - 1][1], 1))
+        else:
+            samples.append(
+                (dt.datetime.strptime(ts, '%Y-%m-%d %H:%M:%S.%f'), *values))
+    return samples
+
+
+def check_history_replay(history_samples, poll_samples):
+    """Compare the replay of the history query with a per-poll replay.
+
+    :return: number of samples of each, state mismatches and if the
+    heating cycles are the same.
+    """
+    states = [estimate_heating_states(*list(zip(*samples))[1:]).tolist()
+              if samples else [] for samples in (history_samples,
+                                                 poll_samples)]
+    mismatches = abs(len(states[0]) - len(states[1])) + sum(
+        s_h != s_p for s_h, s_p in zip(*states))
+    _, _, cycles_history = replay_heating_states(history_samples)
+    _, _, cycles_poll = replay_heating_states(poll_samples)
+    return (len(history_samples), len(poll_samples), mismatches,
+            cycles_history.attributes == cycles_poll.attributes)
+
+
+class _Stats(object):
+    """Latency, transferred rows and allocations of one stage."""
+
+    def __init__(self):
+        self.timings = []
+        self.rows = []
+        self.peak_kb = 0
+
+
+@asyncio.coroutine
+def run_benchmark(hass, args, db_path):
+    """Run all the stages and return the stats of each one."""
+    conn, last_ts = make_database(db_path, args.rows, args.step)
+    devices = [(s_type, s_mag, name, None, None, 1)
+               for s_type, s_mag, name in DEVICES]
+    data = yield from hass.async_add_job(
+        EnerwebData, hass, 'localhost', devices, hass.config.time_zone,
+        10, None, None, BACKEND_MYSQL, 10, 120,
+        'sqlite:///{}'.format(db_path))
+    # (updates are driven by the benchmark, without the polling timer)
+    data._stopped = True
+    data._unsub_update()
+
+    # Count the rows transferred by the handler queries
+    transferred = [0]
+    query_last_values = data._query_last_values
+
+    def _counted_query(s_type):
+        rows = query_last_values(s_type)
+        transferred[0] += len(rows)
+        return rows
+
+    data._query_last_values = _counted_query
+    stats = {stage: _Stats() for stage in STAGES}
+
+    @asyncio.coroutine
+    def _measure(stage, coro_func):
+        transferred[0] = 0
+        tracemalloc.start()
+        tic = perf_counter()
+        result = yield from coro_func()
+        stats[stage].timings.append(perf_counter() - tic)
+        peak = tracemalloc.get_traced_memory()[1] / 1024
+        tracemalloc.stop()
+        stats[stage].rows.append(transferred[0])
+        stats[stage].peak_kb = max(stats[stage].peak_kb, peak)
+        return result
+
+    yield from _measure('cold', data.async_update)
+    for i in range(args.repeat):
+        yield from _measure('idle', data.async_update)
+        last_ts += dt.timedelta(seconds=args.step)
+        new_sample = next(synthetic_samples(1, args.step, last_ts))
+        insert_samples(conn, [new_sample])  # (not measured)
+        yield from _measure('new_rows', data.async_update)
+
+    sensor_keys = [('ds18b20', SENSOR_IDS['supply']),
+                   ('ds18b20', SENSOR_IDS['return']), ('dht22', 'temp')]
+
+    history_samples = []
+
+    @asyncio.coroutine
+    def _history():
+        samples = yield from data.async_query_history(
+            sensor_keys, args.hours, [1, 1, 1])
+        transferred[0] = len(samples)
+        # (SQLite returns the timestamps of raw queries as text)
+        samples = [(dt.datetime.strptime(ts, '%Y-%m-%d %H:%M:%S.%f'),
+                    *values) for ts, *values in samples]
+        history_samples[:] = samples
+        return replay_heating_states(samples)
+
+    for _ in range(max(1, args.repeat // 5)):
+        state, _, cycles = yield from _measure('history', _history)
+    poll_samples = []
+    if history_samples:
+        poll_samples = per_poll_samples(conn, str(history_samples[0][0]))
+    conn.close()
+    yield from hass.async_add_job(data.close)
+    return (stats, state, cycles, check_heating_estimator(history_samples),
+            check_history_replay(history_samples, poll_samples))
+
+
+def main():
+    """Parse the CLI arguments, run the benchmark and report the results."""
+    parser = argparse.ArgumentParser(
+        description='Benchmark of the enerweb data handler with SQLite')
+    parser.add_argument('--rows', type=int, default=1000000,
+                        help='Approximate number of rows in the DB')
+    parser.add_argument('--step', type=int, default=30,
+                        help='Seconds between synthetic samples')
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='Number of repeated updates')
+    parser.add_argument('--hours', type=int, default=24,
+                        help='Hours of data for the heater backfill')
+    args = parser.parse_args()
+
+    loop = asyncio.get_event_loop()
+    hass = HomeAssistant(loop)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        hass.config.config_dir = tmp_dir
+        db_path = os.path.join(tmp_dir, 'enerweb.db')
+        tic = perf_counter()
+        stats, state, cycles, oracle, replay = loop.run_until_complete(
+            run_benchmark(hass, args, db_path))
+        total = perf_counter() - tic
+        db_size = os.path.getsize(db_path)
+    loop.run_until_complete(hass.async_stop())
+
+    print('Enerweb benchmark: ~{} rows ({:.1f} MB SQLite DB), {} updates, '
+          'total {:.1f} s'.format(args.rows, db_size / 1024 ** 2,
+                                  args.repeat, total))
+    print('{:<10} {:>10} {:>10} {:>10} {:>8} {:>14}'.format(
+        'stage', 'min [ms]', 'mean [ms]', 'max [ms]', 'rows',
+        'peak alloc [KB]'))
+    for stage in STAGES:
+        values = [1000 * t for t in stats[stage].timings]
+        rows = stats[stage].rows
+        print('{:<10} {:>10.3f} {:>10.3f} {:>10.3f} {:>8.0f} {:>14.1f}'.format(
+            stage, min(values), sum(values) / len(values), max(values),
+            sum(rows) / len(rows), stats[stage].peak_kb))
+    print('Heater state after the backfill: {}, {}'.format(
+        state, cycles.attributes))
+    print('Batch heating estimator vs live state machine: {} samples, '
+          '{} mismatches ({:.1f} ms vs {:.1f} ms)'.format(
+              oracle[0], oracle[1], 1000 * oracle[2], 1000 * oracle[3]))
+    print('History replay vs per-poll replay: {} vs {} samples, '
+          '{} mismatches, same heating cycles: {}'.format(*replay))
+
+
+if __name__ == '__main__':
+    main()
@@ -8,7 +8,10 @@ import asyncio
 
 from homeassistant.const import (
     CONF_NAME, ATTR_FRIENDLY_NAME, ATTR_UNIT_OF_MEASUREMENT, ATTR_ICON)
-from ..psychrometrics import DOMAIN, PsychrometricsSensor
+from ..psychrometrics import (
+    DOMAIN, CONF_CHART, CONF_PROPERTIES, ATTR_NAME_SUFFIX,
+    PSYCHROMETRIC_PROPERTIES, PsychrometricsSensor,
+    PsychrometricsPropertySensor)
 
 
 DEPENDENCIES = ['psychrometrics']
@@ -20,12 +23,21 @@ def async_setup_platform(hass, config, async_add_devices, discovery_info=None):
     if discovery_info is None:
         return
 
+    chart_handler = hass.data[DOMAIN][discovery_info[CONF_CHART]]
+    if CONF_PROPERTIES in discovery_info:
+        suffix = discovery_info[ATTR_NAME_SUFFIX]
+        sensors = []
+        for prop in discovery_info[CONF_PROPERTIES]:
+            name, fn_name, unit, icon, _ = PSYCHROMETRIC_PROPERTIES[prop]
+            sensors.append(PsychrometricsPropertySensor(
+                chart_handler, prop, name + suffix, fn_name, unit, icon))
+        async_add_devices(sensors)
+        return
+
     name = discovery_info[CONF_NAME]
     unit = discovery_info[ATTR_UNIT_OF_MEASUREMENT]
     fn_name = discovery_info[ATTR_FRIENDLY_NAME]
     icon = discovery_info[ATTR_ICON]
 
-    chart_handler = hass.data[DOMAIN]
-
     async_add_devices(
         [PsychrometricsSensor(chart_handler, name, fn_name, unit, icon)])